@@ -1,6 +1,7 @@
 from .peucrl import PeUcrlAgt
 
 import copy as cp
+import numpy as np
 
 class NoShieldAgt(PeUcrlAgt):
 
@@ -30,4 +31,10 @@ class UnsafeBaselineAgt(PeUcrlAgt):
         self.new_pruning = False
 
     def reward_shaping(self, tabular_state, tabular_action):
-        return 0.0
\ No newline at end of file
+        return 0.0
+
+    def reward_shaping_table(self):
+        return np.zeros(
+            shape=(self.prior_knowledge.n_states, self.prior_knowledge.n_actions),
+            dtype=float,
+        )
\ No newline at end of file
@@ -1,6 +1,5 @@
 from .peucrl import PeUcrlAgt
 from agents.utils import *
-from gym_cellular.envs.utils import generalized_cellular2tabular as cellular2tabular, generalized_tabular2cellular as tabular2cellular
 
 import copy as cp
 import numpy as np
@@ -36,18 +35,16 @@ class AlwaysSafeAgtPsoAgt(PeUcrlAgt):
                 if count in self.prior_knowledge.cell_labelling[cell]:
                     if cell_class in delicate_cell_classes:
                         self.delicate_cell_set.add(cell)
+        self.delicate_cells = np.isin(np.arange(self.prior_knowledge.n_cells), list(self.delicate_cell_set))
 
     def pe_shield(self, behaviour_policy, target_policy, p_estimate):
+        order = random_cell_order(self.prior_knowledge.n_cells) # randomisation not relevant here, except for the order in updated_cells
+        updated_cells = order[~self.delicate_cells[order]]
         tmp_policy = cp.copy(behaviour_policy)
-        cell_set = set(range(self.prior_knowledge.n_cells))
-        while len(cell_set) >= 1:
-            cell = np.random.choice(list(cell_set)) # randomisation not relevant here
-            cell_set -= {cell}
-            if cell not in self.delicate_cell_set:
-                tmp_policy[cell, :] = cp.copy(target_policy[cell, :])
-                self.policy_update[cell] = 1 # only relevant for debugging here
-                self.data['updated_cells'] = self.data['updated_cells'] + str(cell) + '|'
-        self.policy = cp.copy(tmp_policy)
+        tmp_policy[updated_cells, :] = target_policy[updated_cells, :]
+        self.policy_update[updated_cells] = 1 # only relevant for debugging here
+        self.data['updated_cells'] = self.data['updated_cells'] + ''.join(str(cell) + '|' for cell in updated_cells)
+        self.policy = tmp_policy
 
 
 class NationLikeAgt(PeUcrlAgt):
@@ -85,21 +82,25 @@ class NationLikeAgt(PeUcrlAgt):
         else:
             self.new_episode = False
 
-    def distances(self):
+    def distances(self, changed_pairs=None, changed_transfer_pairs=None):
         # greediness means zero distances
         assert (self.p_distances == 0).all()
         assert (self.r_distances == 0).all()
 
     def pe_shield(self, behaviour_policy, target_policy, p_estimate):
+        n_cells = self.prior_knowledge.n_cells
+        # the cell order and the draws alternate as in a loop over the cells, so seeded results are unchanged
+        order = np.zeros(n_cells, dtype=int)
+        draws = np.zeros(n_cells)
+        remaining = list(range(n_cells))
+        for count in range(n_cells):
+            order[count] = remaining.pop(np.random.randint(n_cells - count))
+            draws[count] = np.random.rand()
+        # with small probability, update the policy greedily
+        updated_cells = order[draws < np.asarray(self.conservativeness)[order]]
         tmp_policy = cp.copy(behaviour_policy)
-        cell_set = set(range(self.prior_knowledge.n_cells))
-        while len(cell_set) >= 1:
-            cell = np.random.choice(list(cell_set))
-            cell_set -= {cell}
-            # with small probability, update the policy greedily
-            if np.random.rand() < self.conservativeness[cell]:
-                tmp_policy[cell, :] = cp.copy(target_policy[cell, :])
-        self.policy = cp.copy(tmp_policy)
+        tmp_policy[updated_cells, :] = target_policy[updated_cells, :]
+        self.policy = tmp_policy
 
 
 class AupAgt(PeUcrlAgt):
@@ -123,6 +124,13 @@ class AupAgt(PeUcrlAgt):
             self.prior_knowledge.n_actions,
             self.n_aux_reward_funcs,
         )
+        self.aux_u = None
+        self.cached_aux_q_values = None
+        self.cached_penalty_table = None
+        # the no-op action of every state is the action of the initial policy
+        self.noop_actions = self.index_tables.tabular_actions(self.initial_policy.T)
+        self.data['mean_penalty'] = ''
+        self.data['max_penalty'] = ''
 
     
     def pe_shield(self, behaviour_policy, target_policy, p_estimate):
@@ -132,75 +140,73 @@ class AupAgt(PeUcrlAgt):
 
     def auxVI(self, r_estimate, p_estimate, epsilon=0.01, max_iter=int(1e6)): # max_iter=1000
         
-        """This function implements a standard value iterationn algorithm, i.e. not an extended one.
-        The regulatory constraints should accept n_aux_reward_funcs as an argument.
-        It should also accept a regularization parameter.
+        """This function implements a standard value iteration algorithm, i.e. not an extended one.
+        All auxiliary reward functions are solved at once, r_estimate has shape (n_states, n_actions, n_aux_reward_funcs).
+        Unsampled transition estimates are considered to be from the uniform distribution, without modifying p_estimate.
+        The values of the last call are the starting point, so later episodes converge in fewer iterations.
+        Returns the Q-values of shape (n_states, n_actions, n_aux_reward_funcs).
         """
 
-        # initialise a Q-map, which is not necessary in PeUcrl
-        Q = np.zeros(
-            shape=(
-                self.prior_knowledge.n_states,
-                self.prior_knowledge.n_actions,
-            )
+        Q, self.aux_u = batched_value_iteration(
+            r_estimate,
+            p_estimate,
+            self.transition_indicator,
+            epsilon=epsilon,
+            max_iter=max_iter,
+            u=self.aux_u,
         )
-        # consider unsampled estimates to be from the uniform distribution
-        for s in range(self.prior_knowledge.n_states):
-            for a in range(self.prior_knowledge.n_actions):
-                if (p_estimate[s, a, :] == 0).all():
-                    p_estimate[s, a, :] = 1. / self.prior_knowledge.n_states
-    
-        u0 = self.u - min(self.u)
-        u1 = np.zeros(self.prior_knowledge.n_states)
-        niter = 0
-        while True:
-            niter += 1
-            for s in range(self.prior_knowledge.n_states):
-
-                temp = np.zeros(self.prior_knowledge.n_actions)
-                for a in range(self.prior_knowledge.n_actions):
-                    # simpler standard VI
-                    temp[a] = r_estimate[s, a] + sum(
-                        [P * V for P, V in zip(p_estimate[s,a,:], u0[:])]
-                    )
-                    # let the pruning of actions still apply
-                    temp[a] *= self.transition_indicator[s, a]
-                    Q[s,a] = temp[a] # save to the Q-map
-                # This implements a tie-breaking rule by choosing:  Uniform(Argmmin(Nk))
-                (u1[s], arg) = allmax(temp)
-
-            diff = [abs(x - y) for (x, y) in zip(u1, u0)]
-            if (max(diff) - min(diff)) < epsilon:
-                self.u = u1 - min(u1)
-                break
-            else:
-                u0 = u1 - min(u1)
-                u1 = np.zeros(self.prior_knowledge.n_states)
-            if niter > max_iter:
-                self.u = u1 - min(u1)
-                print("No convergence in EVI")
-                break
-
-            # the outputs are also different from the standard VI
-            return Q
+        return Q
+
+    # The auxiliary Q-values, only recomputed after they have been invalidated.
+    # They are invalidated when p_estimate or the transition indicators change, i.e. at a new episode or a new pruning.
+    def aux_q_values(self):
+        if self.cached_aux_q_values is None:
+            self.cached_aux_q_values = self.auxVI(self.aux_reward_funcs, self.p_estimate)
+        return self.cached_aux_q_values
+
+    def estimates(self, changed_pairs=None, changed_transfer_pairs=None):
+        super().estimates(changed_pairs, changed_transfer_pairs)
+        self.cached_aux_q_values = None
+        self.cached_penalty_table = None
+
+    # The regularizer of all state-action pairs as an array of shape (n_states, n_actions), shared by EVI and regularizer.
+    # It is recomputed together with the auxiliary Q-values, and its mean and maximum are reported in the data of that step.
+    def penalty_table(self):
+        if self.cached_penalty_table is None:
+            Q = self.aux_q_values()
+            noop_Q = Q[np.arange(self.prior_knowledge.n_states), self.noop_actions]
+            penalty = np.sum(np.abs(Q - noop_Q[:, np.newaxis, :]), axis=2)
+            scale = np.sum(noop_Q, axis=1)[:, np.newaxis]
+            # no penalty where the no-op action has no auxiliary value, e.g. because it is pruned
+            self.cached_penalty_table = self.regularization_param * np.divide(
+                penalty,
+                scale,
+                out=np.zeros_like(penalty),
+                where=scale > 0,
+            )
+            self.data['mean_penalty'] = float(np.mean(self.cached_penalty_table))
+            self.data['max_penalty'] = float(np.max(self.cached_penalty_table))
+        return self.cached_penalty_table
+
+    def sample_action(self, state):
+        self.data['mean_penalty'] = ''
+        self.data['max_penalty'] = ''
+        return super().sample_action(state)
 
-    
     def reward_shaping(self, tabular_state, tabular_action):
         standard = super().reward_shaping(tabular_state, tabular_action)
-        penalty = 0
-        scale = 0
-        for count in range(self.n_aux_reward_funcs):
-            r_estimate = self.aux_reward_funcs[:,:,count]
-            p_estimate = self.p_estimate
-            Q = self.auxVI(r_estimate, p_estimate)
-            noop = cellular2tabular(
-                self.initial_policy[:, tabular_state],
-                self.prior_knowledge.action_space,
-            )
-            penalty += np.abs(
-                Q[tabular_state,tabular_action] - Q[tabular_state,noop]
-            )
-            scale += Q[tabular_state,noop]
-        regularizer = self.regularization_param * penalty / scale
-        return standard - regularizer
+        return standard - self.regularizer(tabular_state, tabular_action)
+
+    def reward_shaping_table(self):
+        return super().reward_shaping_table() - self.penalty_table()
+
+    def action_pruning(self):
+        super().action_pruning()
+        if self.new_pruning:
+            self.cached_shaping_table = None # the regularizer depends on the transition indicators
+            self.cached_aux_q_values = None
+            self.cached_penalty_table = None
+
+    def regularizer(self, tabular_state, tabular_action):
+        return self.penalty_table()[tabular_state, tabular_action]
 
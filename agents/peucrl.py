@@ -1,17 +1,48 @@
 """Copypasted and modified, cite"""
 
 from agents.utils import *
-from gym_cellular.envs.utils import generalized_cellular2tabular as cellular2tabular, generalized_tabular2cellular as tabular2cellular
+from gym_cellular.envs.utils import generalized_tabular2cellular as tabular2cellular
 
+from collections import deque
 import copy as cp
 import numpy as np
-import os
-from psutil import Process
 import subprocess
+import threading
 import time
 
 class PeUcrlAgt:
 
+    # backend for the extended value iteration, 'array', 'loop' (reference implementation) or 'factored'
+    # 'factored' keeps the intracellular model when cells have identical transitions, otherwise it is the same as 'array'
+    evi_backend = 'array'
+    # backend for PRISM, 'server' (one long-lived PRISM process) or 'cli' (a new PRISM process per verification)
+    # 'server' falls back to 'cli' when the server cannot be started
+    prism_backend = 'server'
+    # maximum number of cached verification results and optional file to keep them between runs
+    verification_cache_size = 10000
+    verification_cache_path = None
+    # check properties of bounded PCTL with the interval DTMC checker instead of PRISM, other properties always go to PRISM
+    native_verification = True
+    # model written for PRISM, 'full' (all states) or 'pruned' (only what a bounded property can observe from the current state)
+    # 'pruned' is the same as 'full' for unbounded properties and for properties that refer to s
+    model_export = 'pruned'
+    # format of the model files, 'language' (PRISM language) or 'explicit' (.tra/.sta/.lab files that PRISM does not need to parse)
+    # 'explicit' imports the files as an interval DTMC with the PRISM command line, as the server only reads the PRISM language
+    model_format = 'language'
+    # 'sequential' verifies the candidate of each cell on its own
+    # 'batched' verifies the candidates of all cells at once, assuming that all are verified, with the same result as 'sequential'
+    # 'speculative' also sends likely alternatives to the PRISM server ahead of time, which checks them while the shield waits,
+    # with the same result as 'sequential'
+    shield_mode = 'batched'
+    # number of candidates of alternative chains that 'speculative' sends ahead, they all go to the single PRISM server of the process,
+    # which checks one model at a time, so every alternative that is not needed delays the end of the shield by one check
+    n_speculative_alternatives = 1
+    # lump the states of models for PRISM that only differ by a permutation of interchangeable cells,
+    # if the model is invariant and the property only counts cells
+    symmetry_reduction = True
+    # directory for the scratch files of PRISM, None picks a RAM-backed one such as /dev/shm if available
+    prism_workspace_dir = None
+
     def name(self):
         return 'PE-UCRL'
 
@@ -48,10 +79,13 @@ class PeUcrlAgt:
             shape=(self.prior_knowledge.n_states, self.prior_knowledge.n_actions),
             dtype=float,
         )
-        self.Pk = np.zeros(
-            shape=(self.prior_knowledge.n_states, self.prior_knowledge.n_actions, self.prior_knowledge.n_states),
-            dtype=int,
-        )
+        if self.factored_planning():
+            self.Pk = None # the joint transition counts are never used in factored planning
+        else:
+            self.Pk = np.zeros(
+                shape=(self.prior_knowledge.n_states, self.prior_knowledge.n_actions, self.prior_knowledge.n_states),
+                dtype=int,
+            )
         self.u = np.zeros(
             shape=self.prior_knowledge.n_states,
             dtype=float,
@@ -78,6 +112,15 @@ class PeUcrlAgt:
             shape=(self.prior_knowledge.n_states, self.prior_knowledge.n_actions),
             dtype=float,
         )
+        self.r_distance_factors = np.full(
+            shape=(self.prior_knowledge.n_states, self.prior_knowledge.n_actions),
+            fill_value=1 / np.sqrt(2),
+            dtype=float,
+        ) # the count-dependent factors of r_distances
+        self.p_distance_factors = np.ones(
+            shape=(self.prior_knowledge.n_states, self.prior_knowledge.n_actions),
+            dtype=float,
+        ) # the count-dependent factors of p_distances
         self.Rk = np.zeros(
             shape=(self.prior_knowledge.n_states, self.prior_knowledge.n_actions),
             dtype=float,
@@ -110,10 +153,27 @@ class PeUcrlAgt:
             shape=(self.prior_knowledge.n_states, self.prior_knowledge.n_actions),
             dtype=float,
         )
-        self.p_estimate = np.zeros(
-            shape=(self.prior_knowledge.n_states, self.prior_knowledge.n_actions, self.prior_knowledge.n_states),
-            dtype=float,
-        )
+        self.index_tables = CellularIndexTables(
+            self.prior_knowledge.n_states,
+            self.prior_knowledge.n_actions,
+            self.prior_knowledge.state_space,
+            self.prior_knowledge.action_space,
+            tabular2cellular,
+        ) # shared with the planners and the PRISM export
+        if self.factored_planning():
+            self.p_estimate = FactoredTransitions(
+                np.zeros(
+                    shape=(self.prior_knowledge.n_intracellular_states, self.prior_knowledge.n_intracellular_actions, self.prior_knowledge.n_intracellular_states),
+                    dtype=float,
+                ),
+                self.index_tables.state_cells,
+                self.index_tables.action_cells,
+            )
+        else:
+            self.p_estimate = np.zeros(
+                shape=(self.prior_knowledge.n_states, self.prior_knowledge.n_actions, self.prior_knowledge.n_states),
+                dtype=float,
+            )
 
 
         # Misc initializations
@@ -122,10 +182,7 @@ class PeUcrlAgt:
             space=self.prior_knowledge.state_space,
         )
         self.last_cellular_state = initial_cellular_state
-        self.initial_tabular_state = cellular2tabular(
-            initial_cellular_state,
-            self.prior_knowledge.state_space,
-        )
+        self.initial_tabular_state = self.index_tables.tabular_state(initial_cellular_state)
         self.last_tabular_state = cp.copy(self.initial_tabular_state)
         self.current_tabular_state = cp.copy(self.initial_tabular_state)
         self.initial_policy = np.zeros(
@@ -148,7 +205,11 @@ class PeUcrlAgt:
             dtype=int,
         )
         self.rc = [0.0] * self.prior_knowledge.n_cells
-        self.side_effects_funcs = [{'safe', 'unsafe'} for _ in range(self.prior_knowledge.n_intracellular_states)]
+        self.side_effects_status = np.full(
+            shape=self.prior_knowledge.n_intracellular_states,
+            fill_value=UNKNOWN,
+            dtype=np.uint8,
+        ) # see agents/utils/side_effects.py
         self.initial_safe_intracellular_states = set()
         for state in self.prior_knowledge.initial_safe_states:
             cellular_state = self.prior_knowledge.cellularize(
@@ -156,8 +217,9 @@ class PeUcrlAgt:
                 space=self.prior_knowledge.state_space,
             )
             for intracellular_state in cellular_state:
-                self.side_effects_funcs[intracellular_state] -= {'unsafe'}
+                self.side_effects_status[intracellular_state] &= ~np.uint8(UNSAFE)
                 self.initial_safe_intracellular_states.add(intracellular_state)
+        self.side_effects_masks()
         self.new_pruning = False
         self.intracellular_transition_indicator = np.ones(
             shape=(self.prior_knowledge.n_intracellular_states, self.prior_knowledge.n_intracellular_actions),
@@ -168,6 +230,7 @@ class PeUcrlAgt:
             dtype=int,
         )
         self.path = [set() for _ in range(self.prior_knowledge.n_cells)]
+        self.cached_shaping_table = None
 
         # data collection
         self.data = {}
@@ -175,17 +238,34 @@ class PeUcrlAgt:
         self.new_episode = False
         self.new_pruning = False
         self.data['updated_cells'] = ''
+        self.data['verification_cache_hits'] = 0
+        self.data['verification_cache_misses'] = 0
+        self.verification_cache = VerificationCache(self.verification_cache_size, self.verification_cache_path)
+        self.workspace = Workspace(self.prism_workspace_dir)
+        self.prism_writers = {} # one per thread, see prism_writer
+        self.bounded_property = parse_bounded_property(self.prism_props, self.model_variable_names())
+        self.cell_symmetries = CellSymmetries(
+            self.index_tables.state_cells,
+            self.index_tables.state_weights,
+            interchangeable_cells(self.prior_knowledge.n_cells, self.prior_knowledge.cell_labelling, self.index_tables.state_cells),
+        )
+        # properties that refer to s or to single cells distinguish the states of an orbit
+        self.symmetric_property = property_names(self.prism_props).isdisjoint(
+            ['s'] + ['c_' + str(cell) for cell in range(self.prior_knowledge.n_cells)]
+        )
 
 
     def reset_seed(self):
         np.random.seed(self.seed)
 
+    # Whether planning uses the intracellular model without building the joint transition tensor.
+    def factored_planning(self):
+        return self.evi_backend == 'factored' and self.prior_knowledge.identical_intracellular_transitions is True
+
 
     # Auxiliary function to update N the current state-action count.
     def updateN(self):
-        for s in range(self.prior_knowledge.n_states):
-            for a in range(self.prior_knowledge.n_actions):
-                self.Nk[s, a] += self.vk[s, a]
+        self.Nk += self.vk
 
     # Auxiliary function to update v the accumulated state-action count.
     def updatev(self):
@@ -197,6 +277,8 @@ class PeUcrlAgt:
 
     # Auxiliary function to update P the transitions count.
     def updateP(self):
+        if self.Pk is None:
+            return
         self.Pk[self.last_tabular_state, self.last_tabular_action, self.current_tabular_state] += 1
 
     def update_intracellularv(self):
@@ -207,32 +289,30 @@ class PeUcrlAgt:
         for si, ai, next_si in zip(self.last_cellular_state, self.last_cellular_action, self.current_cellular_state):
             self.intracellularPk[si, ai, next_si] += 1
 
-    def update_transferv(self):
-        for s in range(self.prior_knowledge.n_states):
-            for a in range(self.prior_knowledge.n_actions):
-                intracellular_pair_set = zip(
-                    tabular2cellular(s, self.prior_knowledge.state_space),
-                    tabular2cellular(a, self.prior_knowledge.action_space),
-                )
-                self.transfervk[s,a] = min(
-                    [self.intracellularvk[si, ai] for si, ai in intracellular_pair_set]
-                )
+    # Recomputes transfer[s, a] as the minimum of intracellular[si, ai] over the cells of (s, a).
+    # Only the joint pairs containing one of the flat intracellular pairs are recomputed (all pairs by default).
+    # Returns the flat indices of the recomputed joint pairs.
+    def update_transfer(self, transfer, intracellular, intracellular_pairs=None):
+        if intracellular_pairs is None:
+            joint_pairs = np.arange(transfer.size)
+        else:
+            joint_pairs = self.index_tables.joint_pairs_containing(intracellular_pairs)
+        transfer.reshape(-1)[joint_pairs] = np.min(
+            intracellular.reshape(-1)[self.index_tables.pair_cells[joint_pairs]],
+            axis=1,
+        )
+        return joint_pairs
+
+    def update_transferv(self, intracellular_pairs=None):
+        return self.update_transfer(self.transfervk, self.intracellularvk, intracellular_pairs)
     
     def update_intracellularN(self):
         for si in range(self.prior_knowledge.n_intracellular_states):
             for ai in range(self.prior_knowledge.n_intracellular_actions):
                 self.intracellularNk[si, ai] += self.intracellularvk[si, ai]
 
-    def update_transferN(self):
-        for s in range(self.prior_knowledge.n_states):
-            for a in range(self.prior_knowledge.n_actions):
-                intracellular_pair_set = zip(
-                    tabular2cellular(s, self.prior_knowledge.state_space),
-                    tabular2cellular(a, self.prior_knowledge.action_space),
-                )
-                self.transferNk[s,a] = min(
-                    [self.intracellularNk[si, ai] for si, ai in intracellular_pair_set]
-                )
+    def update_transferN(self, intracellular_pairs=None):
+        return self.update_transfer(self.transferNk, self.intracellularNk, intracellular_pairs)
 
 
     # def update_transferv(self):
@@ -256,61 +336,136 @@ class PeUcrlAgt:
     #                         self.transfervk[s, a] += 1
 
 
-    def estimates(self):
-        for s in range(self.prior_knowledge.n_states):
-            for a in range(self.prior_knowledge.n_actions):
-                maxN = max([1, self.Nk[s, a]])
-                self.r_estimate[s, a] = self.Rk[s, a] / maxN
-                for next_s in range(self.prior_knowledge.n_states):
-                    if self.prior_knowledge.identical_intracellular_transitions is False:
-                        self.p_estimate[s, a, next_s] = self.Pk[s, a, next_s] / maxN
-                    else:
-                        p_estimate = lambda si, ai, next_si: self.intracellularPk[si,ai,next_si] / max(1, self.intracellularNk[si,ai])
-                        self.p_estimate[s, a, next_s] = np.prod(
-                            [
-                                p_estimate(si, ai, next_si) for si, ai, next_si in zip(
-                                    tabular2cellular(s, self.prior_knowledge.state_space),
-                                    tabular2cellular(a, self.prior_knowledge.action_space),
-                                    tabular2cellular(next_s, self.prior_knowledge.state_space),
-                                )
-                            ]
-                        )
-                        # maxN = max([1, self.transferNk[s,a]])
-                        # self.p_estimate[s, a, next_s] = self.transferPk[s, a, next_s] / maxN
-                    assert 0 <= self.r_estimate[s, a] <= 1
-                    assert 0 <= self.p_estimate[s, a, next_s] <= 1
+    # The (s, a) pairs whose cellular components include at least one of the intracellular pairs in the (si, ai) mask.
+    def joint_pairs_containing(self, intracellular_pairs):
+        joint_pairs = np.zeros(
+            shape=(self.prior_knowledge.n_states, self.prior_knowledge.n_actions),
+            dtype=bool,
+        )
+        joint_pairs.reshape(-1)[self.index_tables.joint_pairs_containing(np.flatnonzero(intracellular_pairs))] = True
+        return joint_pairs
+
+    # Only the rows in changed_pairs are recomputed (all rows by default).
+    # With identical intracellular transitions, the transition rows in changed_transfer_pairs are recomputed instead.
+    def estimates(self, changed_pairs=None, changed_transfer_pairs=None):
+        if changed_pairs is None:
+            changed_pairs = np.ones(
+                shape=(self.prior_knowledge.n_states, self.prior_knowledge.n_actions),
+                dtype=bool,
+            )
+        if changed_transfer_pairs is None:
+            changed_transfer_pairs = changed_pairs
+        s, a = np.nonzero(changed_pairs)
+        self.r_estimate[s, a] = normalized_counts(self.Rk[s, a], self.Nk[s, a])
+        assert (0 <= self.r_estimate[s, a]).all() and (self.r_estimate[s, a] <= 1).all()
+        if self.factored_planning():
+            self.p_estimate = FactoredTransitions(
+                normalized_counts(self.intracellularPk, self.intracellularNk),
+                self.index_tables.state_cells,
+                self.index_tables.action_cells,
+            )
+            assert (0 <= self.p_estimate.intracellular).all() and (self.p_estimate.intracellular <= 1).all()
+            return
+        if self.prior_knowledge.identical_intracellular_transitions is False:
+            if self.Pk is None:
+                # subclasses that drop the assumption after PeUcrlAgt.__init__ never counted joint transitions
+                raise ValueError('evi_backend "factored" needs identical intracellular transitions, which ' + self.name() + ' does not assume')
+            self.p_estimate[s, a] = normalized_counts(self.Pk[s, a], self.Nk[s, a])
+        else:
+            s, a = np.nonzero(changed_transfer_pairs)
+            self.p_estimate[s, a] = product_transitions(
+                normalized_counts(self.intracellularPk, self.intracellularNk),
+                self.index_tables.state_cells[s],
+                self.index_tables.action_cells[a],
+                self.index_tables.state_cells,
+            )
+        assert (0 <= self.p_estimate[s, a]).all() and (self.p_estimate[s, a] <= 1).all()
+
     # Auxiliary function updating the values of r_distances and p_distances (i.e. the confidence bounds used to build the set of plausible MDPs)
-    def distances(self):
-        for s in range(self.prior_knowledge.n_states):
-            for a in range(self.prior_knowledge.n_actions):
-                maxN = max([1, self.Nk[s, a]])
-                self.r_distances[s, a] = np.sqrt((7 * np.log(2 * self.prior_knowledge.n_states * self.prior_knowledge.n_actions * self.t / self.prior_knowledge.confidence_level))
-                                                 / (2 * maxN))
-                if self.prior_knowledge.identical_intracellular_transitions is True:
-                    maxN = max([1, self.transferNk[s, a]])
-                self.p_distances[s, a] = np.sqrt((14 * self.prior_knowledge.n_states * np.log(2 * self.prior_knowledge.n_actions * self.t / self.prior_knowledge.confidence_level))
-                                                / (maxN))
+    # The count-dependent factors are only recomputed for the rows in changed_pairs and changed_transfer_pairs (all rows by default).
+    def distances(self, changed_pairs=None, changed_transfer_pairs=None):
+        if changed_pairs is None:
+            changed_pairs = np.ones(
+                shape=(self.prior_knowledge.n_states, self.prior_knowledge.n_actions),
+                dtype=bool,
+            )
+        if changed_transfer_pairs is None:
+            changed_transfer_pairs = changed_pairs
+        s, a = np.nonzero(changed_pairs)
+        self.r_distance_factors[s, a] = 1 / np.sqrt(2 * np.maximum(1, self.Nk[s, a]))
+        if self.prior_knowledge.identical_intracellular_transitions is True:
+            s, a = np.nonzero(changed_transfer_pairs)
+            self.p_distance_factors[s, a] = 1 / np.sqrt(np.maximum(1, self.transferNk[s, a]))
+        else:
+            self.p_distance_factors[s, a] = 1 / np.sqrt(np.maximum(1, self.Nk[s, a]))
+        np.multiply(
+            np.sqrt(7 * np.log(2 * self.prior_knowledge.n_states * self.prior_knowledge.n_actions * self.t / self.prior_knowledge.confidence_level)),
+            self.r_distance_factors,
+            out=self.r_distances,
+        )
+        self.cached_shaping_table = None
+        np.multiply(
+            np.sqrt(14 * self.prior_knowledge.n_states * np.log(2 * self.prior_knowledge.n_actions * self.t / self.prior_knowledge.confidence_level)),
+            self.p_distance_factors,
+            out=self.p_distances,
+        )
 
     # Computing the maximum proba in the Extended Value Iteration for given state s and action a.
     def max_proba(self, p_estimate, sorted_indices, s, a):
-        min1 = min([1, p_estimate[s, a, sorted_indices[-1]] + (self.p_distances[s, a] / 2)])
-        max_p = np.zeros(self.prior_knowledge.n_states)
-        if min1 == 1:
-            max_p[sorted_indices[-1]] = 1
-        else:
-            max_p = cp.deepcopy(p_estimate[s, a])
-            max_p[sorted_indices[-1]] += self.p_distances[s, a] / 2
-            l = 0
-            while sum(max_p) > 1: 
-                max_p[sorted_indices[l]] = max([0, 1 - sum(max_p) + max_p[sorted_indices[l]]])  # Error? 
-                l += 1
-        return max_p
+        return optimistic_transitions(p_estimate[s, a], self.p_distances[s, a], sorted_indices)
 
     # The Extend Value Iteration algorithm (approximated with precision epsilon), in parallel policy updated with the greedy one.
     def EVI(self, r_estimate, p_estimate, epsilon=0.01, max_iter=int(1e6)): # max_iter=1000
+        if self.evi_backend in ['array', 'factored']:
+            self.array_EVI(r_estimate, p_estimate, epsilon=epsilon, max_iter=max_iter)
+        elif self.evi_backend == 'loop':
+            self.loop_EVI(r_estimate, p_estimate, epsilon=epsilon, max_iter=max_iter)
+        else:
+            raise ValueError('evi_backend must be either "array", "loop" or "factored"')
+
+    # Same as loop_EVI, but each sweep is done with array operations over (S, A, S).
+    # With factored transition estimates, the sweeps are per-cell contractions instead.
+    def array_EVI(self, r_estimate, p_estimate, epsilon=0.01, max_iter=int(1e6)):
+        if hasattr(self.prior_knowledge, 'reward_func'):
+            optimistic_reward = self.reward_func
+        else:
+            optimistic_reward = np.minimum(1, r_estimate + self.r_distances)
+        optimistic_reward = np.minimum(1, optimistic_reward + self.get_reward_shaping_table())
+        u0 = self.u - min(self.u)
+        sorted_indices = np.arange(self.prior_knowledge.n_states)
+        niter = 0
+        while True:
+            niter += 1
+            if isinstance(p_estimate, FactoredTransitions):
+                temp = optimistic_reward + p_estimate.optimistic_expectations(self.p_distances, u0, sorted_indices)
+            else:
+                temp = optimistic_reward + optimistic_expectations(p_estimate, self.p_distances, sorted_indices, u0)
+            temp *= self.transition_indicator
+            u1 = np.max(temp, axis=1)
+            diff = np.abs(u1 - u0)
+            if (max(diff) - min(diff)) < epsilon:
+                break
+            if niter > max_iter:
+                print("No convergence in EVI")
+                break
+            u0 = u1 - min(u1)
+            sorted_indices = np.argsort(u0)
+        self.u = u1 - min(u1)
+        # This implements a tie-breaking rule by choosing:  Uniform(Argmmin(Nk))
+        greedy = temp == u1[:, np.newaxis]
+        nn = np.where(self.transition_indicator == 1, -self.Nk, -np.inf)
+        nmax = np.max(np.where(greedy, nn, -np.inf), axis=1)
+        choice = greedy & (nn == nmax[:, np.newaxis])
+        ranks = np.floor(np.random.rand(self.prior_knowledge.n_states) * np.sum(choice, axis=1))
+        sampled_tabular_actions = np.argmax(choice & (np.cumsum(choice, axis=1) == ranks[:, np.newaxis] + 1), axis=1)
+        self.policy[:, :] = self.index_tables.action_cells[sampled_tabular_actions].T
+
+    # The reference implementation of the Extended Value Iteration with Python loops.
+    def loop_EVI(self, r_estimate, p_estimate, epsilon=0.01, max_iter=int(1e6)):
         u0 = self.u - min(self.u)  #sligthly boost the computation and doesn't seems to change the results
         u1 = np.zeros(self.prior_knowledge.n_states)
         sorted_indices = np.arange(self.prior_knowledge.n_states)
+        shaping = self.get_reward_shaping_table()
         niter = 0
         while True:
             niter += 1
@@ -323,7 +478,7 @@ class PeUcrlAgt:
                         optimistic_reward = self.reward_func[s, a]
                     else:
                         optimistic_reward = min([1, r_estimate[s, a] + self.r_distances[s, a]])
-                    optimistic_reward = min([1, optimistic_reward + self.reward_shaping(s, a)]) # I think this should work fine theoretically for nown reward functions, but it is a bit less clear what I should do with unknown reward functions, I might get a factor of 2 somewhere in the proof.
+                    optimistic_reward = min([1, optimistic_reward + shaping[s, a]]) # I think this should work fine theoretically for nown reward functions, but it is a bit less clear what I should do with unknown reward functions, I might get a factor of 2 somewhere in the proof.
                     temp[a] = optimistic_reward + sum(
                         [u * p for (u, p) in zip(u0, max_p)])
                     temp[a] *= self.transition_indicator[s, a]
@@ -332,10 +487,7 @@ class PeUcrlAgt:
                 nn = [-self.Nk[s, a] if self.transition_indicator[s,a]==1 else -np.inf for a in arg]
                 (nmax, arg2) = allmax(nn)
                 choice = [arg[a] for a in arg2]
-                sampled_cellular_action = tabular2cellular(
-                    np.random.choice(choice),
-                    self.prior_knowledge.action_space,
-                )
+                sampled_cellular_action = self.index_tables.action_cells[np.random.choice(choice)]
                 self.policy[:, s] = cp.copy(sampled_cellular_action)
 
             diff = [abs(x - y) for (x, y) in zip(u1, u0)]
@@ -355,24 +507,29 @@ class PeUcrlAgt:
     # To start a new episode (init var, computes estmates and run EVI).
     def off_policy(self):
         if self.new_episode and not self.new_pruning:
+            changed_pairs = self.vk != 0 # the rows to update, found before vk is folded into Nk
+            changed_transfer_pairs = None
             self.updateN()
             self.vk = np.zeros(
                 shape=(self.prior_knowledge.n_states, self.prior_knowledge.n_actions),
                 dtype=int,
             )
             if self.prior_knowledge.identical_intracellular_transitions is True:
+                changed_intracellular_pairs = np.flatnonzero(self.intracellularvk)
+                changed_transfer_pairs = self.joint_pairs_containing(self.intracellularvk != 0)
                 if not hasattr(self.prior_knowledge, 'reward_func'):
-                    self.update_transferv()
+                    self.update_transferv(changed_intracellular_pairs)
                     assert (self.transfervk >= self.vk).all()
                 self.update_intracellularN()
-                self.update_transferN()
+                self.update_transferN(changed_intracellular_pairs)
                 assert (self.transferNk >= self.Nk).all()
                 self.intracellularvk = np.zeros(
                     shape=(self.prior_knowledge.n_intracellular_states, self.prior_knowledge.n_intracellular_actions),
                     dtype=int,
                 )
-            self.estimates()
-            self.distances()
+                self.transfervk[:, :] = 0 # consistent with the reset intracellular counts
+            self.estimates(changed_pairs, changed_transfer_pairs)
+            self.distances(changed_pairs, changed_transfer_pairs)
         behaviour_policy = cp.copy(self.policy)
         self.EVI(self.r_estimate, self.p_estimate, epsilon=1. / max(1, self.t))
         target_policy = cp.copy(self.policy)
@@ -392,27 +549,20 @@ class PeUcrlAgt:
             element=state,
             space=self.prior_knowledge.state_space,
         )
-        self.last_tabular_state = cellular2tabular(
-            self.last_cellular_state,
-            self.prior_knowledge.state_space,
-        )
+        self.last_tabular_state = self.index_tables.tabular_state(self.last_cellular_state)
         assert self.last_tabular_state == self.current_tabular_state
         self.last_cellular_action = cp.copy(self.policy[:, self.last_tabular_state])
-        self.last_tabular_action = cellular2tabular(
-            self.last_cellular_action,
-            self.prior_knowledge.action_space,
-        )
+        self.last_tabular_action = self.index_tables.tabular_action(self.last_cellular_action)
         self.stopping_criterion()
         self.data['off_policy_time'] = np.nan
         self.data['updated_cells'] = ''
+        self.data['verification_cache_hits'] = 0
+        self.data['verification_cache_misses'] = 0
         if self.new_episode or self.new_pruning:
             self.data['off_policy_time'] = time.perf_counter()
             self.off_policy()
             self.last_cellular_action = cp.copy(self.policy[:, self.last_tabular_state])
-            self.last_tabular_action = cellular2tabular(
-                self.last_cellular_action,
-                self.prior_knowledge.action_space,
-            )
+            self.last_tabular_action = self.index_tables.tabular_action(self.last_cellular_action)
         self.data['off_policy_time'] = time.perf_counter() - self.data['off_policy_time']
         output = self.prior_knowledge.decellularize(
             cellular_element=self.last_cellular_action,
@@ -426,10 +576,7 @@ class PeUcrlAgt:
             element=state,
             space=self.prior_knowledge.state_space,
         )
-        self.current_tabular_state = cellular2tabular(
-            self.current_cellular_state,
-            self.prior_knowledge.state_space,
-        )
+        self.current_tabular_state = self.index_tables.tabular_state(self.current_cellular_state)
         self.current_reward = reward
         self.side_effects_processing(info['side_effects'])
         self.action_pruning()
@@ -441,42 +588,58 @@ class PeUcrlAgt:
             self.update_intracellularv()
             assert np.array([self.intracellularvk[s,a] + self.intracellularNk[s,a] >= max(self.intracellularPk[s,a,:]) for s in range(self.prior_knowledge.n_intracellular_states) for a in range(self.prior_knowledge.n_intracellular_actions)]).all()
             if hasattr(self.prior_knowledge, 'reward_func'):
-                self.update_transferv()
-                assert (self.transfervk >= self.vk).all()
+                # only the joint pairs containing the intracellular pairs of this step can change
+                joint_pairs = self.update_transferv(
+                    self.index_tables.intracellular_pairs(self.last_cellular_state, self.last_cellular_action)
+                )
+                assert (self.transfervk.reshape(-1)[joint_pairs] >= self.vk.reshape(-1)[joint_pairs]).all()
         self.t += 1
 
     # Registering new side effects
     def side_effects_processing(self, side_effects):
-        for reporting_cell in range(self.prior_knowledge.n_cells):
-            for reported_cell in range(self.prior_knowledge.n_cells):
-                reported_current_intracellular_state = self.current_cellular_state[reported_cell]
-                if side_effects[reporting_cell, reported_cell] == 'safe':
-                    self.side_effects_funcs[reported_current_intracellular_state] -= {'unsafe'}
-                elif side_effects[reporting_cell, reported_cell] == 'unsafe':
-                    self.side_effects_funcs[reported_current_intracellular_state] -= {'safe'}
+        if side_effects_status_update(self.side_effects_status, self.current_cellular_state, side_effects):
+            self.side_effects_masks()
+            self.cached_shaping_table = None # new side-effect knowledge
+
+    # The joint states containing an intracellular state whose side effects are unknown, or that may be unsafe.
+    # They only change with the side-effect knowledge, so they are recomputed when it changes.
+    def side_effects_masks(self):
+        state_cells = self.index_tables.state_cells
+        self.state_contains_unknown = np.any(self.side_effects_status[state_cells] == UNKNOWN, axis=1)
+        self.state_possibly_unsafe = np.any((self.side_effects_status[state_cells] & UNSAFE) != 0, axis=1)
 
 
     def reward_shaping(self, tabular_state, tabular_action):
-        cellular_state = tabular2cellular(
-            tabular_state,
-            self.prior_knowledge.state_space,
-        )
-        for si in cellular_state:
-            if self.side_effects_funcs[si] == {'safe', 'unsafe'}:
-                return self.r_distances[tabular_state, tabular_action]
+        if self.state_contains_unknown[tabular_state]:
+            return self.r_distances[tabular_state, tabular_action]
         return 0.0
 
+    # Same as reward_shaping, but for all state-action pairs at once.
+    # Subclasses that override reward_shaping should override this too.
+    def reward_shaping_table(self):
+        return np.where(self.state_contains_unknown[:, np.newaxis], self.r_distances, 0.0)
+
+    # The reward shaping table read by EVI, only recomputed after it has been invalidated.
+    # It is invalidated when the side-effect knowledge or r_distances change.
+    def get_reward_shaping_table(self):
+        if self.cached_shaping_table is None:
+            self.cached_shaping_table = self.reward_shaping_table()
+        return self.cached_shaping_table
+
 
     # Action pruning
     def action_pruning(self):
 
         # initialization
         self.new_pruning = False
+        newly_pruned_pairs = []
+        currently_unsafe = self.side_effects_status[self.current_cellular_state] == UNSAFE
         # basic case
         for cell in range(self.prior_knowledge.n_cells):
-            if self.side_effects_funcs[self.current_cellular_state[cell]] == {'unsafe'}:
+            if currently_unsafe[cell]:
                 if self.intracellular_transition_indicator[self.last_cellular_state[cell], self.last_cellular_action[cell]] == 1:
                     self.new_pruning = True
+                    newly_pruned_pairs.append((self.last_cellular_state[cell], self.last_cellular_action[cell]))
                 self.intracellular_transition_indicator[self.last_cellular_state[cell], self.last_cellular_action[cell]] = 0
         # corner cases
         for cell in range(self.prior_knowledge.n_cells):
@@ -485,27 +648,29 @@ class PeUcrlAgt:
                 self.path[cell] = set()
             elif n_unpruned_actions == 1:
                 self.path[cell].add((self.last_cellular_state[cell], self.last_cellular_action[cell]))
-            if self.side_effects_funcs[self.current_cellular_state[cell]] == {'unsafe'} or n_unpruned_actions == 0:
+            if currently_unsafe[cell] or n_unpruned_actions == 0:
                 for (si, ai) in self.path[cell]:
                     if self.intracellular_transition_indicator[si, ai] == 1:
                         self.new_pruning = True
+                        newly_pruned_pairs.append((si, ai))
                     self.intracellular_transition_indicator[si, ai] = 0
-        # update transition indicators
+        # update transition indicators, only the joint pairs containing a newly pruned intracellular pair change
         if self.new_pruning:
-            for s in range(self.prior_knowledge.n_states):
-                for a in range(self.prior_knowledge.n_actions):
-                    for si, ai in zip(
-                            tabular2cellular(s, self.prior_knowledge.state_space),
-                            tabular2cellular(a, self.prior_knowledge.action_space)
-                        ):
-                        if self.intracellular_transition_indicator[si, ai] == 0:
-                            self.transition_indicator[s, a] = 0
-                            break
+            joint_pairs = self.index_tables.joint_pairs_containing(
+                [self.index_tables.intracellular_pairs(si, ai) for si, ai in newly_pruned_pairs]
+            )
+            self.transition_indicator.reshape(-1)[joint_pairs] = 0
 
 
     # Applying shielding
     def pe_shield(self, behaviour_policy, target_policy, p_estimate):
         
+        if self.shield_mode == 'batched':
+            self.batched_pe_shield(behaviour_policy, target_policy, p_estimate)
+            return
+        elif self.shield_mode == 'speculative':
+            self.speculative_pe_shield(behaviour_policy, target_policy, p_estimate)
+            return
         tmp_policy = cp.copy(behaviour_policy)
         cell_set = set(range(self.prior_knowledge.n_cells))
         while len(cell_set) >= 1:
@@ -535,6 +700,170 @@ class PeUcrlAgt:
                 else:
                     self.data['updated_cells'] = self.data['updated_cells'] + str(cell) + '|'
         self.policy = cp.copy(tmp_policy)
+        self.end_shield()
+
+    def end_shield(self):
+        self.verification_cache.dump()
+        # the kept model lines are only useful within a pass, as the estimates change between passes
+        self.prism_writers = {}
+
+    def shield_plan(self):
+        """
+        Draws the cell order and the resets of pe_shield in advance as a list of (cell, reset) pairs.
+        This is possible because the random draws do not depend on the verification results.
+        """
+        plan = []
+        cell_set = set(range(self.prior_knowledge.n_cells))
+        while len(cell_set) >= 1:
+            cell = np.random.choice(list(cell_set))
+            cell_set -= {cell}
+            reset = self.policy_update[cell] == 1
+            reset = (self.last_cellular_state[cell] in self.initial_safe_intracellular_states) and reset
+            if reset:
+                self.rc[cell] += 1.0
+            reset = (np.random.rand() <= 1.0 / max([1.0, self.rc[cell]])) and reset
+            plan.append((cell, reset))
+        return plan
+
+    def shield_candidates(self, plan, tmp_policy, target_policy, policy_update=None):
+        """
+        The candidate policies and policy updates of the cells in plan that are not reset, assuming that every update is verified.
+        policy_update defaults to self.policy_update.
+        """
+        candidates = []
+        policy = cp.copy(tmp_policy)
+        policy_update = cp.copy(self.policy_update if policy_update is None else policy_update)
+        for cell, reset in plan:
+            if reset:
+                policy[cell, :] = self.initial_policy[cell, :]
+                policy_update[cell] = 0
+            else:
+                policy[cell, :] = target_policy[cell, :]
+                policy_update[cell] = 1
+                candidates.append((cp.copy(policy), cp.copy(policy_update)))
+        return candidates
+
+    def commit_shield_results(self, plan, tmp_policy, target_policy, results):
+        """
+        Applies the steps of plan in order as pe_shield would, given the verification results of the cells that are not reset.
+        Stops after the first cell that is not verified and returns the number of steps applied.
+        """
+        results = iter(results)
+        for step, (cell, reset) in enumerate(plan):
+            if reset:
+                tmp_policy[cell, :] = cp.copy(self.initial_policy[cell, :])
+                self.policy_update[cell] = 0
+                self.data['updated_cells'] = self.data['updated_cells'] + '(' + str(cell) + ')' + '|'
+            elif next(results):
+                tmp_policy[cell, :] = cp.copy(target_policy[cell, :])
+                self.policy_update[cell] = 1
+                self.data['updated_cells'] = self.data['updated_cells'] + str(cell) + '|'
+            else:
+                # the policy and the policy update of the cell stay as they were
+                return step + 1
+        return len(plan)
+
+    def batched_pe_shield(self, behaviour_policy, target_policy, p_estimate):
+        """
+        Same result as the sequential pe_shield.
+        All candidates are verified in one batch under the assumption that every update is verified.
+        After the first failure, the candidates of the remaining cells are rebuilt and verified in a new batch.
+        """
+        tmp_policy = cp.copy(behaviour_policy)
+        plan = self.shield_plan()
+        while len(plan) >= 1:
+            candidates = self.shield_candidates(plan, tmp_policy, target_policy)
+            results = self.verify_batch(candidates, p_estimate)
+            plan = plan[self.commit_shield_results(plan, tmp_policy, target_policy, results):]
+        self.policy = cp.copy(tmp_policy)
+        self.end_shield()
+
+    def speculative_candidates(self, plan, tmp_policy, target_policy):
+        """
+        The candidates of the chain where every update is verified, followed by those of the chains where exactly one update is not.
+        The alternatives are taken in plan order until there are n_speculative_alternatives of them.
+        """
+        chain = self.shield_candidates(plan, tmp_policy, target_policy)
+        candidates = list(chain)
+        policy, policy_update = cp.copy(tmp_policy), cp.copy(self.policy_update)
+        for position, (cell, reset) in enumerate(plan):
+            if len(candidates) >= len(chain) + self.n_speculative_alternatives:
+                break
+            if not reset:
+                # the update of cell is not verified, the rest of plan continues from the same policy
+                candidates += self.shield_candidates(plan[position + 1:], policy, target_policy, policy_update)
+            policy[cell, :] = self.initial_policy[cell, :] if reset else target_policy[cell, :]
+            policy_update[cell] = 0 if reset else 1
+        return candidates
+
+    def speculative_pe_shield(self, behaviour_policy, target_policy, p_estimate):
+        """
+        Same result as the sequential pe_shield.
+        The likely candidates are sent to the PRISM server in advance, which checks them in order while their results are used in the original cell order.
+        Candidates that were not anticipated are sent when they are reached.
+        Without the server, the candidates that are not decided in process are verified one by one as in pe_shield.
+        """
+        self.data['prism_error'] = ''
+        tmp_policy = cp.copy(behaviour_policy)
+        plan = self.shield_plan()
+        self.initialize_prism_files()
+        server = self.prism_server()
+        # results and models by cache key, results are None until they are received,
+        # and the keys and tickets of the requests in the order they were sent
+        verifications, models, sent = {}, {}, deque()
+        for policy, policy_update in self.speculative_candidates(plan, tmp_policy, target_policy):
+            self.submit_verification(verifications, models, sent, server, policy, policy_update, p_estimate)
+        while len(plan) >= 1:
+            results = []
+            for policy, policy_update in self.shield_candidates(plan, tmp_policy, target_policy):
+                key = self.submit_verification(verifications, models, sent, server, policy, policy_update, p_estimate)
+                results.append(self.verification_result(verifications, models, sent, server, key))
+                if not results[-1]:
+                    break
+            plan = plan[self.commit_shield_results(plan, tmp_policy, target_policy, results):]
+        # the answers to alternatives that did not happen are still read, so that the server is free for the next shield, and cached
+        while len(sent) >= 1:
+            self.receive_verification(verifications, sent, server)
+        self.policy = cp.copy(tmp_policy)
+        self.end_shield()
+
+    def submit_verification(self, verifications, models, sent, server, tmp_policy, policy_update, p_estimate):
+        """
+        Decides a candidate in process or sends it to the server, and returns its cache key.
+        The model is written here, as the server must not see the agent while it keeps learning.
+        """
+        model, key, verified = self.verify_in_process(tmp_policy, p_estimate, policy_update)
+        if key not in verifications:
+            verifications[key] = verified
+            models[key] = model
+            if verified is None and server is not None:
+                # every request has its own model file, which stays until the request is answered
+                name = 'model' + str(len(models))
+                self.write_model(model, name)
+                try:
+                    [ticket] = server.send([(self.prism_path + name + '.prism', self.prism_path + 'constraints.props')])
+                    sent.append((key, ticket))
+                except PrismError:
+                    pass # verified with the PRISM files when it is reached
+        return key
+
+    def receive_verification(self, verifications, sent, server):
+        """Reads the answer to the oldest request that was sent, answers with errors are left to verification_result."""
+        key, ticket = sent.popleft()
+        try:
+            verified, error_message = server.receive(ticket)
+        except PrismError:
+            return
+        if error_message == '':
+            verifications[key] = verified
+            self.verification_cache.put(key, verified)
+
+    def verification_result(self, verifications, models, sent, server, key):
+        while verifications[key] is None and any(sent_key == key for sent_key, _ in sent):
+            self.receive_verification(verifications, sent, server)
+        if verifications[key] is None:
+            verifications[key] = self.verify_with_prism_files(models[key], key)
+        return verifications[key]
 
     # Prism
     def verify_with_prism(
@@ -545,114 +874,237 @@ class PeUcrlAgt:
     ):
         
         self.data['prism_error'] = ''
+        model, key, verified = self.verify_in_process(tmp_policy, p_estimate)
+        if verified is None:
+            verified = self.verify_with_prism_files(model, key, n_attempts)
+        return verified
+
+    def verify_in_process(self, tmp_policy, p_estimate, policy_update=None):
+        """
+        Returns the model for PRISM, its cache key and the result from the cache or the interval DTMC checker.
+        The result is None if PRISM is needed.
+        """
+        lb, ub = self.interval_bounds(tmp_policy, p_estimate)
+        constants = self.side_effects_constants(policy_update)
+        model = self.model_from_bounds(lb, ub, constants)
+        key = self.verification_key(model)
+        return model, key, self.check_in_process(key, lb, ub, constants)
+
+    def verification_key(self, model):
+        """
+        Cache key of the model for PRISM and the property, which determine the result.
+        The model only has the states that the property can observe, so candidates that differ elsewhere share a key.
+        """
+        return verification_key(model.indptr, model.indices, model.lb, model.ub, model.constants, np.array(model.init), self.prism_props)
+
+    def check_in_process(self, key, lb, ub, constants):
+        verified = self.verification_cache.get(key)
+        if verified is not None:
+            self.data['verification_cache_hits'] += 1
+            return verified
+        self.data['verification_cache_misses'] += 1
+        if self.native_verification and self.bounded_property is not None:
+            model = IntervalDtmc(lb, ub, self.last_tabular_state, self.model_variables(constants))
+            # PRISM decides how to report intervals that contain no distribution
+            if model.is_feasible():
+                verified = self.bounded_property.check(model)
+                self.verification_cache.put(key, verified)
+                return verified
+        return None
+
+    def verify_with_prism_files(self, model, key, n_attempts=3):
         for attempt in range(n_attempts):
             try:
                 self.initialize_prism_files()
-                self.write_model_file(tmp_policy, p_estimate)
+                self.write_model(model)
                 verified = self.run_prism()
+                self.verification_cache.put(key, verified)
                 break
             except PrismError as error:
                 if attempt == n_attempts - 1:
                     #raise PrismError
                     verified = False
                     self.data['prism_error'] = str(error)
-                os.system('rm -r -f ' + self.prism_path) # clean
-        os.system('rm -r -f ' + self.prism_path) # clean
         return verified
-    
-    def initialize_prism_files(self):
-        cpu_id = Process().cpu_num()
-        tmp_id = np.random.randint(0, time.time_ns())
-        self.prism_path = '.prism_tmps/' + str(cpu_id) + str(tmp_id)[-5:] + '/'
-        while True:
+
+    def verify_batch(self, candidates, p_estimate):
+        """
+        Verifies a list of (policy, policy update) pairs in order and returns the results up to the first failure.
+        Candidates that are not decided in process are sent to the PRISM server together.
+        """
+        self.data['prism_error'] = ''
+        models, keys, results = [], [], []
+        for tmp_policy, policy_update in candidates:
+            model, key, verified = self.verify_in_process(tmp_policy, p_estimate, policy_update)
+            models.append(model)
+            keys.append(key)
+            results.append(verified)
+            if verified is False:
+                break
+        pending = [i for i, verified in enumerate(results) if verified is None]
+        if len(pending) >= 1 and self.prism_batch_available():
             try:
-                os.mkdir(self.prism_path)
+                self.initialize_prism_files()
+                for i in pending:
+                    self.write_model(models[i], 'model' + str(i))
+                batch_results = self.prism_server().check_batch([
+                    (self.prism_path + 'model' + str(i) + '.prism', self.prism_path + 'constraints.props') for i in pending
+                ])
+                for i, verified in zip(pending, batch_results):
+                    results[i] = verified
+                    self.verification_cache.put(keys[i], verified)
+            except PrismError:
+                pass # the remaining candidates are verified one by one below
+        for i in range(len(results)):
+            if results[i] is None:
+                results[i] = self.verify_with_prism_files(models[i], keys[i])
+            if results[i] is False:
+                results = results[:i + 1]
                 break
-            except FileExistsError:
-                time.sleep(0.1)
-        with open(self.prism_path + 'constraints.props', 'w') as props_file:
-            props_file.write(self.prism_props)
+        return results
+
+    def prism_batch_available(self):
+        return self.prism_server() is not None
+
+    def prism_server(self):
+        """The PRISM server of the process, or None if models are checked with the PRISM command line."""
+        if self.prism_backend == 'server' and self.model_format == 'language':
+            return get_prism_server()
+        return None
+
+    def model_variable_names(self):
+        """Names of the variables and formulas of the model file."""
+        names = ['s', 'n']
+        names += ['c_' + str(cell) for cell in range(self.prior_knowledge.n_cells)]
+        names += ['n_' + cell_class for cell_class in self.prior_knowledge.cell_classes]
+        return names
+
+    def model_variables(self, constants):
+        """Values of the variables and formulas of the model file in each tabular state, the c_i are given by constants."""
+        variables = {'s': np.arange(constants.shape[0]), 'n': constants.sum(axis=1)}
+        for cell in range(self.prior_knowledge.n_cells):
+            variables['c_' + str(cell)] = constants[:, cell]
+        for count, cell_class in enumerate(self.prior_knowledge.cell_classes):
+            variables['n_' + cell_class] = constants[:, list(self.prior_knowledge.cell_labelling[count])].sum(axis=1)
+        return variables
+
+    def interval_bounds(
+            self,
+            tmp_policy,
+            p_estimate,
+            epsilon: float = 0.000000000000001,
+        ):
+        """
+        Returns the lower and upper bounds of the transition intervals of the induced interval DTMC.
+        The bounds are arrays of shape (n_states, n_states).
+        """
+        tabular_policy = self.index_tables.tabular_actions(tmp_policy.T)
+        states = np.arange(self.prior_knowledge.n_states)
+        p_rows = p_estimate[states, tabular_policy]
+        p_distances = self.p_distances[states, tabular_policy][:, np.newaxis]
+        lb = np.maximum(epsilon, np.maximum(0, p_rows - p_distances))
+        ub = np.minimum(1-epsilon, np.minimum(1, p_rows + p_distances))
+        return lb, ub
+
+    def side_effects_constants(self, policy_update=None):
+        """
+        Returns the constants C of the model file as an array of shape (n_states, n_cells).
+        C is 1 for updated cells in states containing an intracellular state that may be unsafe.
+        policy_update defaults to self.policy_update.
+        """
+        if policy_update is None:
+            policy_update = self.policy_update
+        return np.outer(self.state_possibly_unsafe, policy_update == 1).astype(int)
+    
+    def initialize_prism_files(self):
+        self.prism_path = self.workspace.path()
+        self.write_props_file(self.prism_path)
+
+    def write_props_file(self, path):
+        prism_props = self.prism_props
+        if self.model_format == 'explicit':
+            prism_props = substitute_formulas(prism_props, self.model_formulas())
+        self.workspace.write(path + 'constraints.props', prism_props)
+
+    def exported_bounds(self, lb, ub, constants):
+        """
+        Returns the bounds, constants and initial state of the model for PRISM.
+        The model is lumped by the cell symmetries when symmetry_reduction is on and neither the model nor the property breaks them.
+        The interval DTMC checker does not lump, as checking the symmetry costs about as much as its bounded value iteration.
+        """
+        init = self.last_tabular_state
+        if self.symmetry_reduction and self.symmetric_property:
+            variables = self.model_variables(constants)
+            counts = np.column_stack([variables['n']] + [variables['n_' + cell_class] for cell_class in self.prior_knowledge.cell_classes])
+            if self.cell_symmetries.is_invariant(lb, ub, counts):
+                return self.cell_symmetries.lump(lb, ub, constants, init)
+        return lb, ub, constants, init
+
+    def model_formulas(self):
+        return model_formulas(self.prior_knowledge.n_cells, self.prior_knowledge.cell_classes, self.prior_knowledge.cell_labelling)
     
+    def exported_model(self, tmp_policy, p_estimate, policy_update=None):
+        lb, ub = self.interval_bounds(tmp_policy, p_estimate)
+        return self.model_from_bounds(lb, ub, self.side_effects_constants(policy_update))
+
+    def model_from_bounds(self, lb, ub, constants):
+        """The model for PRISM of the interval bounds and constants, from the current state."""
+        lb, ub, constants, init = self.exported_bounds(lb, ub, constants)
+        bounded_property = self.bounded_property
+        if self.model_export == 'pruned' and bounded_property is not None and 's' not in bounded_property.variable_names:
+            return pruned_model(lb, ub, constants, init, bounded_property.horizon)
+        return full_model(lb, ub, constants, init)
+
     def write_model_file(
             self,
             tmp_policy,
             p_estimate,
-            epsilon: float = 0.000000000000001,
+            name='model',
+            path=None,
+            policy_update=None,
         ):
         
-        os.system('rm -fr ' + self.prism_path + 'model.prism')
-        with open(self.prism_path + 'model.prism', 'a') as prism_file:
-
-            prism_file.write('dtmc\n\n')
+        self.write_model(self.exported_model(tmp_policy, p_estimate, policy_update), name, path)
 
-            for s in range(self.prior_knowledge.n_states):
-                for cell in range(self.prior_knowledge.n_cells):
-                    C = 0
-                    if self.policy_update[cell] == 1:
-                        state = tabular2cellular(
-                            s,
-                            self.prior_knowledge.state_space,
-                        )
-                        for si in state:
-                            if 'unsafe' in self.side_effects_funcs[si]:
-                                C = 1
-                                break
-                    prism_file.write('const int C' + str(s) + '_' + str(cell) + ' = ' + str(C) + ';\n')
-            prism_file.write('\n')
+    def write_model(self, model, name='model', path=None):
+        if path is None:
+            path = self.prism_path
+        if self.model_format == 'explicit':
+            for extension, contents in explicit_files(model).items():
+                with open(path + name + '.' + extension, 'w') as model_file:
+                    model_file.write(contents)
+        else:
+            with open(path + name + '.prism', 'w') as prism_file:
+                prism_file.write(self.prism_writer().write(model, self.model_formulas()))
 
-            prism_file.write('module M\n\n')
+    def prism_writer(self):
+        """Writer of the calling thread, which only regenerates the lines that changed since its last model."""
+        thread_id = threading.get_ident()
+        if thread_id not in self.prism_writers:
+            self.prism_writers[thread_id] = PrismLanguageWriter()
+        return self.prism_writers[thread_id]
 
-            prism_file.write('s : [0..' + str(self.prior_knowledge.n_states) + '] init ' + str(self.last_tabular_state) + ';\n')
-            for cell in range(self.prior_knowledge.n_cells):
-                prism_file.write('c_' + str(cell) + ' : [0..1] init C' + str(self.last_tabular_state) + '_' + str(cell) + ';\n')
-            prism_file.write('\n')
+    def run_prism(self, path=None):
+        if path is None:
+            path = self.prism_path
+        if self.model_format == 'explicit':
+            return self.run_prism_cli([
+                '-importtrans', path + 'model.tra',
+                '-importstates', path + 'model.sta',
+                '-importlabels', path + 'model.lab',
+                '-idtmc',
+                '-ex', # interval models are only supported by the explicit engine
+                path + 'constraints.props',
+            ])
+        server = self.prism_server()
+        if server is not None:
+            self.prism_output = None
+            return server.check(path + 'model.prism', path + 'constraints.props')
+        return self.run_prism_cli([path + 'model.prism', path + 'constraints.props'])
 
-            for s in range(self.prior_knowledge.n_states):
-                prism_file.write('[] (s = ' + str(s) + ') -> ')
-                a = cellular2tabular(
-                    tmp_policy[:, s], 
-                    self.prior_knowledge.action_space,
-                )
-                init_iter = True
-                for next_s in range(self.prior_knowledge.n_states):
-                    lb = max(
-                        epsilon,
-                        max(
-                            0,
-                            p_estimate[s, a, next_s] - self.p_distances[s, a]
-                        ),
-                    )
-                    ub = min(
-                        1-epsilon,
-                        min(
-                            1,
-                            p_estimate[s, a, next_s] + self.p_distances[s, a]
-                        ),
-                    )
-                    if not init_iter:
-                        prism_file.write(' + ')
-                    prism_file.write('[' + str(lb) + ',' + str(ub) + "] : (s' = " + str(next_s) + ')')
-                    for cell in range(self.prior_knowledge.n_cells):
-                        prism_file.write(' & (c_' + str(cell) + "' = C" + str(next_s) + '_' + str(cell) + ')')
-                    init_iter = False
-                prism_file.write(';\n')
-            prism_file.write('\n')
-
-            prism_file.write('endmodule\n\n')
-
-            prism_file.write("formula n = ")
-            for cell in range(self.prior_knowledge.n_cells):
-                prism_file.write("c_" + str(cell)+ " + ")
-            prism_file.write("0;\n")
-            for count, cell_class in enumerate(self.prior_knowledge.cell_classes):
-                prism_file.write("formula n_" + cell_class + " = ")
-                for cell in self.prior_knowledge.cell_labelling[count]:
-                    prism_file.write("c_" + str(cell) + " + ")
-                prism_file.write("0;\n")
-
-    def run_prism(self):
+    def run_prism_cli(self, arguments):
         try:
-            command = ['prism/prism/bin/prism', self.prism_path + 'model.prism', self.prism_path + 'constraints.props']
+            command = ['prism/prism/bin/prism'] + arguments
             output = subprocess.check_output(command, timeout=None)
             self.prism_output = output # for debugging purposes
         except subprocess.CalledProcessError as error:
@@ -693,8 +1145,4 @@ class PeUcrlAgt:
         self.data['updated_cells'] = self.data['updated_cells'][:-1]
         self.data['regulatory_constraints'] = self.regulatory_constraints
         return self.data
-    
-    
-class PrismError(Exception):
-    pass
 
@@ -83,9 +83,7 @@ class Ucrl2Agt:
 
     # Auxiliary function to update N the current state-action count.
     def updateN(self):
-        for s in range(self.prior_knowledge.n_states):
-            for a in range(self.prior_knowledge.n_actions):
-                self.Nk[s, a] += self.vk[s, a]
+        self.Nk += self.vk
 
     # Auxiliary function to update v the accumulated state-action count.
     def updatev(self):
@@ -101,76 +99,52 @@ class Ucrl2Agt:
 
     # Auxiliary function updating the values of r_distances and p_distances (i.e. the confidence bounds used to build the set of plausible MDPs).
     def distances(self):
-        for s in range(self.prior_knowledge.n_states):
-            for a in range(self.prior_knowledge.n_actions):
-                self.r_distances[s, a] = np.sqrt((7 * np.log(2 * self.prior_knowledge.n_states * self.prior_knowledge.n_actions * self.t / self.prior_knowledge.confidence_level))
-                                                 / (2 * max([1, self.Nk[s, a]])))
-                self.p_distances[s, a] = np.sqrt((14 * self.prior_knowledge.n_states * np.log(2 * self.prior_knowledge.n_actions * self.t / self.prior_knowledge.confidence_level))
-                                                 / (max([1, self.Nk[s, a]])))
+        counts = np.maximum(1, self.Nk)
+        self.r_distances[:, :] = np.sqrt((7 * np.log(2 * self.prior_knowledge.n_states * self.prior_knowledge.n_actions * self.t / self.prior_knowledge.confidence_level))
+                                         / (2 * counts))
+        self.p_distances[:, :] = np.sqrt((14 * self.prior_knowledge.n_states * np.log(2 * self.prior_knowledge.n_actions * self.t / self.prior_knowledge.confidence_level))
+                                         / counts)
 
     # Computing the maximum proba in the Extended Value Iteration for given state s and action a.
     def max_proba(self, p_estimate, sorted_indices, s, a):
-        min1 = min([1, p_estimate[s, a, sorted_indices[-1]] + (self.p_distances[s, a] / 2)])
-        max_p = np.zeros(self.prior_knowledge.n_states)
-        if min1 == 1:
-            max_p[sorted_indices[-1]] = 1
-        else:
-            max_p = cp.deepcopy(p_estimate[s, a])
-            max_p[sorted_indices[-1]] += self.p_distances[s, a] / 2
-            l = 0
-            while sum(max_p) > 1: 
-                max_p[sorted_indices[l]] = max([0, 1 - sum(max_p) + max_p[sorted_indices[l]]])  # Error? 
-                l += 1
-        return max_p
+        return optimistic_transitions(p_estimate[s, a], self.p_distances[s, a], sorted_indices)
 
     # The Extend Value Iteration algorithm (approximated with precision epsilon), in parallel policy updated with the greedy one.
+    # Each sweep is done with array operations over (S, A, S), with the same optimistic backups as the cellular agents.
     def EVI(self, r_estimate, p_estimate, epsilon=0.01, max_iter=1000):
         u0 = self.u - min(self.u)  #sligthly boost the computation and doesn't seems to change the results
-        u1 = np.zeros(self.prior_knowledge.n_states)
+        optimistic_reward = np.minimum(1, r_estimate + self.r_distances)
         sorted_indices = np.arange(self.prior_knowledge.n_states)
         niter = 0
         while True:
             niter += 1
-            for s in range(self.prior_knowledge.n_states):
-
-                temp = np.zeros(self.prior_knowledge.n_actions)
-                for a in range(self.prior_knowledge.n_actions):
-                    max_p = self.max_proba(p_estimate, sorted_indices, s, a)
-                    temp[a] = min((1, r_estimate[s, a] + self.r_distances[s, a])) + sum(
-                        [u * p for (u, p) in zip(u0, max_p)])
-                # This implements a tie-breaking rule by choosing:  Uniform(Argmmin(Nk))
-                (u1[s], arg) = allmax(temp)
-                nn = [-self.Nk[s, a] for a in arg]
-                (nmax, arg2) = allmax(nn)
-                choice = [arg[a] for a in arg2]
-                self.policy[s] = [1. / len(choice) if x in choice else 0 for x in range(self.prior_knowledge.n_actions)]
-
-            diff = [abs(x - y) for (x, y) in zip(u1, u0)]
+            temp = optimistic_reward + optimistic_expectations(p_estimate, self.p_distances, sorted_indices, u0)
+            u1 = np.max(temp, axis=1)
+            diff = np.abs(u1 - u0)
             if (max(diff) - min(diff)) < epsilon:
-                self.u = u1 - min(u1)
                 break
-            else:
-                u0 = u1 - min(u1)
-                u1 = np.zeros(self.prior_knowledge.n_states)
-                sorted_indices = np.argsort(u0)
             if niter > max_iter:
-                self.u = u1 - min(u1)
                 print("No convergence in EVI")
                 break
+            u0 = u1 - min(u1)
+            sorted_indices = np.argsort(u0)
+        self.u = u1 - min(u1)
+        # This implements a tie-breaking rule by choosing:  Uniform(Argmmin(Nk))
+        greedy = temp == u1[:, np.newaxis]
+        nn = np.where(greedy, -self.Nk, -np.inf)
+        choice = greedy & (nn == np.max(nn, axis=1)[:, np.newaxis])
+        self.policy[:, :] = choice / np.sum(choice, axis=1)[:, np.newaxis]
 
 
     # To start a new episode (init var, computes estmates and run EVI).
     def off_policy(self):
         self.updateN()
-        self.vk = np.zeros((self.prior_knowledge.n_states, self.prior_knowledge.n_actions))
-        r_estimate = np.zeros((self.prior_knowledge.n_states, self.prior_knowledge.n_actions))
-        p_estimate = np.zeros((self.prior_knowledge.n_states, self.prior_knowledge.n_actions, self.prior_knowledge.n_states))
-        for s in range(self.prior_knowledge.n_states):
-            for a in range(self.prior_knowledge.n_actions):
-                div = max([1, self.Nk[s, a]])
-                r_estimate[s, a] = self.Rk[s, a] / div
-                for next_s in range(self.prior_knowledge.n_states):
-                    p_estimate[s, a, next_s] = self.Pk[s, a, next_s] / div
+        self.vk = np.zeros(
+            shape=(self.prior_knowledge.n_states, self.prior_knowledge.n_actions),
+            dtype=int,
+        )
+        r_estimate = normalized_counts(self.Rk, self.Nk)
+        p_estimate = normalized_counts(self.Pk, self.Nk)
         self.distances()
         self.EVI(r_estimate, p_estimate, epsilon=1. / max(1, self.t))
 
@@ -181,13 +155,13 @@ class Ucrl2Agt:
             space=self.prior_knowledge.state_space,
         )
         assert self.last_state == self.current_state
-        self.last_action = categorical_sample([self.policy[self.last_state, a] for a in range(self.prior_knowledge.n_actions)], np.random)
+        self.last_action = categorical_sample(self.policy[self.last_state], np.random)
         self.new_episode = self.vk[self.last_state, self.last_action] >= max([1, self.Nk[self.last_state, self.last_action]])
         self.data['off_policy_time'] = np.nan
         if self.new_episode:
             self.data['off_policy_time'] = perf_counter()
             self.off_policy()
-            self.last_action = categorical_sample([self.policy[self.last_state, a] for a in range(self.prior_knowledge.n_actions)], np.random)
+            self.last_action = categorical_sample(self.policy[self.last_state], np.random)
         self.data['off_policy_time'] = perf_counter() - self.data['off_policy_time']
         output = self.prior_knowledge.detabularize(
             tabular_element=self.last_action,
@@ -1,2 +1,10 @@
 from agents.utils.space_transformations import *
-from agents.utils.argument_selectors import *
\ No newline at end of file
+from agents.utils.argument_selectors import *
+from agents.utils.kernels import *
+from agents.utils.factored_transitions import *
+from agents.utils.prism import *
+from agents.utils.verification_cache import *
+from agents.utils.interval_dtmc import *
+from agents.utils.model_export import *
+from agents.utils.workspace import *
+from agents.utils.side_effects import *
\ No newline at end of file
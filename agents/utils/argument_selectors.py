@@ -94,6 +94,16 @@ def allmin(a):
     return (min_, all_)
 
 
+def random_cell_order(n_cells):
+    """
+    Random order of the cells, drawn as by calling np.random.choice(list(cell_set)) on a shrinking set of cells.
+    A single randint call with decreasing bounds consumes the random stream in the same way, so seeded results are unchanged.
+    """
+    positions = np.random.randint(0, np.arange(n_cells, 0, -1))
+    remaining = list(range(n_cells))
+    return np.array([remaining.pop(position) for position in positions], dtype=int)
+
+
 def categorical_sample(prob_n, np_random):
     """
     Sample from categorical distribution
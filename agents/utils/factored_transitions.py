@@ -0,0 +1,111 @@
+from agents.utils.kernels import product_transitions
+
+import numpy as np
+
+
+class FactoredTransitions:
+
+    """Transition estimates of a cellular MDP where all cells share the same intracellular transition function.
+    The joint S x A x S tensor is never built.
+    Expectations over next states are computed as a sequence of per-cell contractions of the intracellular model.
+    Rows of the joint tensor can still be accessed as p_estimate[s, a] or p_estimate[s, a, next_s], also with integer arrays for s and a.
+    """
+
+    # number of joint transition probabilities computed at once in optimistic_expectations
+    block_entries = 2 ** 20
+
+    def __init__(self, intracellular_p_estimate, state_cells, action_cells):
+        """
+        intracellular_p_estimate: array of shape (n_intracellular_states, n_intracellular_actions, n_intracellular_states)
+        state_cells: array of shape (n_states, n_cells) with the cellular components of each tabular state
+        action_cells: array of shape (n_actions, n_cells) with the cellular components of each tabular action
+        """
+        self.intracellular = np.asarray(intracellular_p_estimate, dtype=float)
+        self.state_cells = state_cells
+        self.action_cells = action_cells
+        self.n_intracellular_states, self.n_intracellular_actions, _ = self.intracellular.shape
+        self.n_cells = state_cells.shape[1]
+        self.shape = (state_cells.shape[0], action_cells.shape[0], state_cells.shape[0])
+        # positions of tabular states in the tensor indexed by (s_0, ..., s_{n_cells-1})
+        self.state_tensor_index = np.ravel_multi_index(
+            tuple(state_cells.T),
+            (self.n_intracellular_states,) * self.n_cells,
+        )
+        # positions of tabular state-action pairs in the tensor indexed by (s_0, a_0, ..., s_{n_cells-1}, a_{n_cells-1})
+        pair_cells = state_cells[:, np.newaxis, :] * self.n_intracellular_actions + action_cells[np.newaxis, :, :]
+        self.pair_tensor_index = np.ravel_multi_index(
+            tuple(np.moveaxis(pair_cells, 2, 0)),
+            (self.n_intracellular_states * self.n_intracellular_actions,) * self.n_cells,
+        )
+
+    def __getitem__(self, index):
+        # integer arrays for states and actions are broadcast against each other as in numpy
+        s, a = np.broadcast_arrays(index[0], index[1])
+        rows = product_transitions(
+            self.intracellular,
+            self.state_cells[s.reshape(-1)],
+            self.action_cells[a.reshape(-1)],
+            self.state_cells,
+        ).reshape(s.shape + (self.shape[2],))
+        if len(index) == 2:
+            return rows
+        return rows[..., index[2]]
+
+    def expectations(self, u):
+        """Expected values of u over next states for all state-action pairs, as an array of shape (n_states, n_actions)."""
+        tensor = np.zeros(self.n_intracellular_states ** self.n_cells)
+        tensor[self.state_tensor_index] = u
+        tensor = tensor.reshape((1,) + (self.n_intracellular_states,) * self.n_cells)
+        for _ in range(self.n_cells):
+            tensor = np.tensordot(tensor, self.intracellular, axes=([1], [2]))
+            tensor = np.moveaxis(tensor, (-2, -1), (1, 2))
+            tensor = tensor.reshape((-1,) + tensor.shape[3:])
+        return tensor.reshape(-1)[self.pair_tensor_index]
+
+    def pair_products(self, tables):
+        """
+        tables: list with an array of shape (n_intracellular_states, n_intracellular_actions) for each cell
+        Returns the products over cells of tables[cell][si, ai] for all joint state-action pairs, as an array of shape (n_states, n_actions).
+        """
+        products = np.ones(self.shape[:2])
+        for cell, table in enumerate(tables):
+            products *= table[self.state_cells[:, cell][:, np.newaxis], self.action_cells[:, cell][np.newaxis, :]]
+        return products
+
+    def optimistic_expectations(self, p_distances, u, sorted_indices):
+        """
+        Same as kernels.optimistic_expectations on the joint rows, that is, the exact inner maximisation of max_proba.
+        Half the distance is moved to the last state in sorted_indices, and the excess mass is removed from the first states in sorted_indices.
+        Only the probabilities of the first states of the rows that lose mass are computed, in blocks of next states.
+        """
+        u = np.asarray(u, dtype=float)
+        half_distances = np.asarray(p_distances, dtype=float) / 2
+        best = sorted_indices[-1]
+        p_best = self.pair_products([self.intracellular[:, :, si] for si in self.state_cells[best]])
+        expectations = self.expectations(u) + half_distances * u[best]
+        excess = self.pair_products([self.intracellular.sum(axis=2)] * self.n_cells) + half_distances - 1
+        # all mass on the best state when the bonus alone exceeds one
+        saturated = p_best + half_distances >= 1
+        expectations[saturated] = u[best]
+        s, a = np.nonzero(~saturated & (excess > 0))
+        excess = excess[s, a]
+        removed = np.zeros(len(s)) # mass removed so far, up to the excess
+        block_size = max(1, self.block_entries // max(1, len(s)))
+        for start in range(0, len(sorted_indices) - 1, block_size):
+            if len(s) == 0:
+                break
+            next_states = sorted_indices[start:min(start + block_size, len(sorted_indices) - 1)]
+            block = product_transitions(
+                self.intracellular,
+                self.state_cells[s],
+                self.action_cells[a],
+                self.state_cells[next_states],
+            )
+            cumulative_p = removed[:, np.newaxis] + np.cumsum(block, axis=1)
+            block_removed = np.clip(excess[:, np.newaxis] - cumulative_p + block, 0, block)
+            expectations[s, a] -= block_removed @ u[next_states]
+            removed = cumulative_p[:, -1]
+            # rows that have lost their excess are done
+            remaining = removed < excess
+            s, a, excess, removed = s[remaining], a[remaining], excess[remaining], removed[remaining]
+        return expectations
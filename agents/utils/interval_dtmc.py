@@ -0,0 +1,323 @@
+import numpy as np
+import re
+
+
+class IntervalDtmc:
+
+    """Interval DTMC over tabular states.
+    Transition probabilities from s to next_s lie in [lb[s, next_s], ub[s, next_s]].
+    Values are computed robustly, i.e. the probabilities are resolved adversarially in every step.
+    """
+
+    def __init__(self, lb, ub, init, variables):
+        """
+        lb, ub: arrays of shape (n_states, n_states) with the bounds of the transition probabilities
+        init: the initial tabular state
+        variables: dict from variable or formula names to integer arrays of shape (n_states,)
+        """
+        self.lb = np.asarray(lb, dtype=float)
+        self.ub = np.asarray(ub, dtype=float)
+        self.init = init
+        self.variables = variables
+
+    def is_feasible(self, tolerance=1e-12):
+        """Whether every row of intervals contains a distribution."""
+        return bool(
+            (self.lb <= self.ub).all()
+            and (self.lb.sum(axis=1) <= 1 + tolerance).all()
+            and (self.ub.sum(axis=1) >= 1 - tolerance).all()
+        )
+
+    def robust_expectations(self, u, minimize=True):
+        """
+        Minimum (or maximum) expected values of u over next states for all states.
+        The lower bounds are assigned first and the remaining mass goes to the lowest (or highest) values of u.
+        """
+        order = np.argsort(u)
+        if not minimize:
+            order = order[::-1]
+        capacity = (self.ub - self.lb)[:, order]
+        remaining = 1 - self.lb.sum(axis=1, keepdims=True)
+        cumulative_capacity = np.cumsum(capacity, axis=1)
+        assigned = np.clip(remaining - cumulative_capacity + capacity, 0, capacity)
+        return self.lb @ u + assigned @ u[order]
+
+
+########################################
+#      Bounded properties parsing      #
+########################################
+
+class BoundedProperty:
+
+    """Conjunction of probabilistic operators over bounded path formulas.
+    Supported path formulas are X ... X phi, F<=k phi, G<=k phi and phi U<=k psi, where phi and psi are state formulas.
+    State formulas are Boolean combinations of (in)equalities over integer variables and formulas of the model.
+    Formulas are stored as nested tuples, see path_values, state_values and expression_values, so that properties can be pickled.
+    """
+
+    def __init__(self, operators, variable_names, horizon):
+        """
+        operators: list of (comparison, bound, path) tuples with path a path formula
+        variable_names: names of the variables and formulas that occur in the property
+        horizon: number of steps the property looks ahead
+        """
+        self.operators = operators
+        self.variable_names = variable_names
+        self.horizon = horizon
+
+    def check(self, model):
+        for comparison, bound, path in self.operators:
+            minimize = comparison in ('>=', '>')
+            probability = path_values(path, model, minimize)[model.init]
+            if not compare_numbers(comparison, probability, bound):
+                return False
+        return True
+
+
+def compare_numbers(comparison, left, right):
+    if comparison == '>=':
+        return left >= right
+    elif comparison == '>':
+        return left > right
+    elif comparison == '<=':
+        return left <= right
+    elif comparison == '<':
+        return left < right
+    elif comparison == '=':
+        return left == right
+    elif comparison == '!=':
+        return left != right
+    raise ValueError('unknown comparison ' + comparison)
+
+
+class UnsupportedProperty(Exception):
+    pass
+
+
+token_pattern = re.compile(r'\s*(?:(\d+\.\d*|\.\d+|\d+)|([A-Za-z_][A-Za-z_0-9]*)|(<=|>=|!=|[<>=!&|()\[\]+\-]))')
+path_keywords = {'P', 'X', 'F', 'G', 'U', 'true', 'false'}
+
+def tokenize_property(string):
+    tokens = []
+    position = 0
+    string = string.rstrip()
+    while position < len(string):
+        match = token_pattern.match(string, position)
+        if match is None:
+            raise UnsupportedProperty('unexpected character at ' + str(position))
+        tokens.append(match.group(match.lastindex))
+        position = match.end()
+    return tokens
+
+
+class PropertyParser:
+
+    """Recursive-descent parser for the bounded fragment, raises UnsupportedProperty outside of it."""
+
+    def __init__(self, string, variable_names):
+        self.tokens = tokenize_property(string)
+        self.position = 0
+        self.allowed_names = set(variable_names)
+        self.variable_names = set()
+        self.horizon = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def take(self, expected=None):
+        token = self.peek()
+        if token is None or (expected is not None and token != expected):
+            raise UnsupportedProperty('expected ' + str(expected) + ' but got ' + str(token))
+        self.position += 1
+        return token
+
+    def integer(self):
+        token = self.take()
+        if not token.isdigit():
+            raise UnsupportedProperty('expected an integer but got ' + token)
+        return int(token)
+
+    def number(self):
+        token = self.take()
+        try:
+            return float(token)
+        except ValueError:
+            raise UnsupportedProperty('expected a number but got ' + token)
+
+    def parse(self):
+        operators = [self.operator()]
+        while self.peek() == '&':
+            self.take('&')
+            operators.append(self.operator())
+        if self.peek() is not None:
+            raise UnsupportedProperty('unexpected ' + self.peek())
+        return BoundedProperty(operators, self.variable_names, self.horizon)
+
+    def operator(self):
+        self.take('P')
+        comparison = self.take()
+        if comparison not in ('>=', '>', '<=', '<'):
+            raise UnsupportedProperty('unsupported probability bound ' + comparison)
+        bound = self.number()
+        self.take('[')
+        path = self.path()
+        self.take(']')
+        return comparison, bound, path
+
+    def path(self):
+        token = self.peek()
+        if token == 'X':
+            n_steps = 0
+            while self.peek() == 'X':
+                self.take('X')
+                n_steps += 1
+            self.horizon = max(self.horizon, n_steps)
+            return ('next', n_steps, self.state_formula())
+        elif token == 'F':
+            self.take('F')
+            self.take('<=')
+            n_steps = self.integer()
+            self.horizon = max(self.horizon, n_steps)
+            return ('until', ('constant', True), self.state_formula(), n_steps)
+        elif token == 'G':
+            self.take('G')
+            self.take('<=')
+            n_steps = self.integer()
+            self.horizon = max(self.horizon, n_steps)
+            return ('globally', self.state_formula(), n_steps)
+        left = self.state_formula()
+        self.take('U')
+        self.take('<=')
+        n_steps = self.integer()
+        self.horizon = max(self.horizon, n_steps)
+        return ('until', left, self.state_formula(), n_steps)
+
+    # state formulas, from the lowest to the highest precedence
+    def state_formula(self):
+        operands = [self.conjunction()]
+        while self.peek() == '|':
+            self.take('|')
+            operands.append(self.conjunction())
+        if len(operands) == 1:
+            return operands[0]
+        return ('or', operands)
+
+    def conjunction(self):
+        operands = [self.negation()]
+        while self.peek() == '&':
+            self.take('&')
+            operands.append(self.negation())
+        if len(operands) == 1:
+            return operands[0]
+        return ('and', operands)
+
+    def negation(self):
+        if self.peek() == '!':
+            self.take('!')
+            operand = self.negation()
+            return ('not', operand)
+        return self.atom()
+
+    def atom(self):
+        token = self.peek()
+        if token == '(':
+            self.take('(')
+            formula = self.state_formula()
+            self.take(')')
+            return formula
+        elif token in ('true', 'false'):
+            return ('constant', self.take() == 'true')
+        left = self.expression()
+        comparison = self.take()
+        if comparison not in ('<=', '>=', '<', '>', '=', '!='):
+            raise UnsupportedProperty('expected a comparison but got ' + comparison)
+        right = self.expression()
+        return ('compare', comparison, left, right)
+
+    def expression(self):
+        terms = [(1, self.term())]
+        while self.peek() in ('+', '-'):
+            sign = 1 if self.take() == '+' else -1
+            terms.append((sign, self.term()))
+        return ('sum', terms)
+
+    def term(self):
+        token = self.take()
+        if token.isdigit():
+            return ('integer', int(token))
+        elif token in self.allowed_names and token not in path_keywords:
+            self.variable_names.add(token)
+            return ('variable', token)
+        raise UnsupportedProperty('unsupported term ' + token)
+
+
+def parse_bounded_property(string, variable_names):
+    """Returns a BoundedProperty or None if the property is not in the bounded fragment."""
+    try:
+        return PropertyParser(string, variable_names).parse()
+    except UnsupportedProperty:
+        return None
+
+
+########################################
+#       Robust value iteration         #
+########################################
+
+# path formulas are ('next', n_steps, formula), ('until', left, right, n_steps) and ('globally', formula, n_steps)
+def path_values(path, model, minimize):
+    """Minimum (or maximum) probabilities of the path formula over the resolutions of the intervals, for all states."""
+    kind = path[0]
+    if kind == 'next':
+        _, n_steps, formula = path
+        values = state_values(formula, model).astype(float)
+        for _ in range(n_steps):
+            values = model.robust_expectations(values, minimize)
+        return values
+    elif kind == 'until':
+        _, left, right, n_steps = path
+        left_holds, right_holds = state_values(left, model), state_values(right, model)
+        values = right_holds.astype(float)
+        for _ in range(n_steps):
+            values = np.where(right_holds, 1.0, np.where(left_holds, model.robust_expectations(values, minimize), 0.0))
+        return values
+    elif kind == 'globally':
+        _, formula, n_steps = path
+        holds = state_values(formula, model)
+        values = holds.astype(float)
+        for _ in range(n_steps):
+            values = np.where(holds, model.robust_expectations(values, minimize), 0.0)
+        return values
+    raise ValueError('unknown path formula ' + str(kind))
+
+# state formulas are ('or', operands), ('and', operands), ('not', operand), ('constant', value) and ('compare', comparison, left, right)
+def state_values(formula, model):
+    """Boolean array with the states that satisfy the state formula."""
+    kind = formula[0]
+    if kind == 'or':
+        return np.logical_or.reduce([state_values(operand, model) for operand in formula[1]])
+    elif kind == 'and':
+        return np.logical_and.reduce([state_values(operand, model) for operand in formula[1]])
+    elif kind == 'not':
+        return np.logical_not(state_values(formula[1], model))
+    elif kind == 'constant':
+        return np.full(model.lb.shape[0], formula[1])
+    elif kind == 'compare':
+        _, comparison, left, right = formula
+        return np.broadcast_to(
+            compare_numbers(comparison, expression_values(left, model), expression_values(right, model)),
+            model.lb.shape[:1],
+        )
+    raise ValueError('unknown state formula ' + str(kind))
+
+# expressions are ('sum', [(sign, term), ...]), ('integer', value) and ('variable', name)
+def expression_values(expression, model):
+    kind = expression[0]
+    if kind == 'sum':
+        return sum(sign * expression_values(term, model) for sign, term in expression[1])
+    elif kind == 'integer':
+        return expression[1]
+    elif kind == 'variable':
+        return model.variables[expression[1]]
+    raise ValueError('unknown expression ' + str(kind))
@@ -0,0 +1,111 @@
+import numpy as np
+
+
+########################################
+#         Optimistic backups           #
+########################################
+
+def sorted_optimistic_transitions(p_estimate, p_distances, sorted_indices):
+    """
+    p_estimate: array of estimated distributions, the last axis is over next states
+    p_distances: array of L1 distances, one for each distribution in p_estimate
+    sorted_indices: next states sorted by increasing value
+    Returns the optimistic distributions with the last axis ordered as sorted_indices.
+    """
+    p_estimate = np.asarray(p_estimate, dtype=float)
+    half_distances = np.asarray(p_distances, dtype=float) / 2
+    best = sorted_indices[-1]
+    sorted_p = p_estimate[..., sorted_indices]
+    sorted_p[..., -1] += half_distances
+    # remove the excess mass starting from the states with the lowest values
+    cumulative_p = np.cumsum(sorted_p, axis=-1)
+    excess = cumulative_p[..., -1:] - 1
+    sorted_p -= np.clip(excess - cumulative_p + sorted_p, 0, sorted_p)
+    # all mass on the best state when the bonus alone exceeds one
+    saturated = p_estimate[..., best] + half_distances >= 1
+    sorted_p[saturated] = 0
+    sorted_p[saturated, -1] = 1
+    return sorted_p
+
+
+def optimistic_transitions(p_estimate, p_distances, sorted_indices):
+    """
+    Batched version of max_proba.
+    Returns the optimistic distributions for all leading indices of p_estimate at once.
+    """
+    sorted_p = sorted_optimistic_transitions(p_estimate, p_distances, sorted_indices)
+    max_p = np.empty_like(sorted_p)
+    max_p[..., sorted_indices] = sorted_p
+    return max_p
+
+
+def optimistic_expectations(p_estimate, p_distances, sorted_indices, u):
+    """
+    Expected values of u under the optimistic distributions.
+    This avoids scattering the distributions back to the original order of next states.
+    """
+    sorted_p = sorted_optimistic_transitions(p_estimate, p_distances, sorted_indices)
+    return sorted_p @ np.asarray(u, dtype=float)[sorted_indices]
+
+
+########################################
+#         Estimation kernels           #
+########################################
+
+def normalized_counts(totals, counts):
+    """
+    totals: accumulated rewards or transition counts, the leading axes are the same as for counts
+    counts: number of visits, zero visits are treated as one
+    """
+    counts = np.maximum(1, np.asarray(counts))
+    return totals / counts.reshape(counts.shape + (1,) * (np.ndim(totals) - counts.ndim))
+
+
+def product_transitions(intracellular_p_estimate, state_cells, action_cells, next_state_cells):
+    """
+    intracellular_p_estimate: array of shape (n_intracellular_states, n_intracellular_actions, n_intracellular_states)
+    state_cells, action_cells: arrays of shape (n_rows, n_cells) with the cellular components of the requested rows
+    next_state_cells: array of shape (n_states, n_cells) with the cellular components of all next states
+    Returns the joint transition estimates of the requested rows as a product over cells.
+    """
+    rows = np.ones(shape=(state_cells.shape[0], next_state_cells.shape[0]), dtype=float)
+    for cell in range(next_state_cells.shape[1]):
+        intracellular_rows = intracellular_p_estimate[state_cells[:, cell], action_cells[:, cell]]
+        rows *= intracellular_rows[:, next_state_cells[:, cell]]
+    return rows
+
+
+########################################
+#          Planning kernels            #
+########################################
+
+def batched_value_iteration(rewards, p_estimate, transition_indicator, epsilon=0.01, max_iter=int(1e6), u=None):
+    """
+    Standard (not extended) relative value iteration for several reward functions at once.
+    rewards: array of shape (n_states, n_actions, n_reward_funcs)
+    p_estimate: array of shape (n_states, n_actions, n_states), rows that are all zero are treated as uniform
+    transition_indicator: array of shape (n_states, n_actions), the Q-values of pruned pairs are zero
+    u: initial values of shape (n_states, n_reward_funcs), zero by default
+    Returns the Q-values of shape (n_states, n_actions, n_reward_funcs) and the values of shape (n_states, n_reward_funcs).
+    All reward functions are updated until the spans of the value differences of all of them are below epsilon.
+    """
+    n_states, n_actions, n_reward_funcs = rewards.shape
+    unsampled = np.all(p_estimate == 0, axis=2, keepdims=True)
+    flat_p = np.where(unsampled, 1. / n_states, p_estimate).reshape(n_states * n_actions, n_states)
+    indicator = transition_indicator[:, :, np.newaxis]
+    if u is None:
+        u = np.zeros((n_states, n_reward_funcs))
+    u0 = u - np.min(u, axis=0)
+    niter = 0
+    while True:
+        niter += 1
+        Q = (rewards + (flat_p @ u0).reshape(n_states, n_actions, n_reward_funcs)) * indicator
+        u1 = np.max(Q, axis=1)
+        diff = np.abs(u1 - u0)
+        if (np.max(diff, axis=0) - np.min(diff, axis=0) < epsilon).all():
+            break
+        if niter > max_iter:
+            print("No convergence in auxiliary VI")
+            break
+        u0 = u1 - np.min(u1, axis=0)
+    return Q, u1 - np.min(u1, axis=0)
@@ -0,0 +1,373 @@
+import numpy as np
+import re
+
+
+class ExportedModel:
+
+    """Sparse interval DTMC in the form it is written to PRISM.
+    The transition intervals are stored row by row as in a CSR matrix:
+    the intervals of model state x are [lb[k], ub[k]] towards indices[k] for k in range(indptr[x], indptr[x + 1]).
+    """
+
+    def __init__(self, indptr, indices, lb, ub, constants, init):
+        """
+        indptr, indices, lb, ub: CSR arrays of the transition intervals
+        constants: array of shape (n_model_states, n_cells) with the C constants of each model state
+        init: the initial model state
+        """
+        self.indptr = indptr
+        self.indices = indices
+        self.lb = lb
+        self.ub = ub
+        self.constants = constants
+        self.init = init
+        self.n_states = constants.shape[0]
+
+    def n_intervals(self):
+        return len(self.indices)
+
+    def dense_bounds(self):
+        """Returns the bounds as arrays of shape (n_model_states, n_model_states), mostly for debugging."""
+        lb = np.zeros((self.n_states, self.n_states))
+        ub = np.zeros((self.n_states, self.n_states))
+        rows = np.repeat(np.arange(self.n_states), np.diff(self.indptr))
+        lb[rows, self.indices] = self.lb
+        ub[rows, self.indices] = self.ub
+        return lb, ub
+
+
+def csr_model(blocks, constants, init):
+    """blocks: list of (support, lb, ub, columns) tuples for consecutive model states, with arrays of shape (n_rows, n_columns) and the model state of each column"""
+    lengths, indices, lb, ub = [], [], [], []
+    for block_support, block_lb, block_ub, columns in blocks:
+        rows, targets = np.nonzero(block_support)
+        lengths.append(block_support.sum(axis=1))
+        indices.append(columns[targets])
+        lb.append(block_lb[rows, targets])
+        ub.append(block_ub[rows, targets])
+    indptr = np.concatenate(([0], np.cumsum(np.concatenate(lengths)))).astype(int)
+    return ExportedModel(indptr, np.concatenate(indices), np.concatenate(lb), np.concatenate(ub), constants, init)
+
+
+def absorbing_block(model_states):
+    n_states = len(model_states)
+    return np.eye(n_states, dtype=bool), np.eye(n_states), np.eye(n_states), model_states
+
+
+def full_model(lb, ub, constants, init):
+    """All tabular states with all their successors, as written by the original exporter."""
+    n_states = lb.shape[0]
+    return ExportedModel(
+        np.arange(n_states + 1) * n_states,
+        np.tile(np.arange(n_states), n_states),
+        lb.reshape(-1),
+        ub.reshape(-1),
+        constants,
+        init,
+    )
+
+
+def reachable_sets(support, init, horizon):
+    """Returns the states reachable within horizon - 1 steps and the states first reached after horizon steps."""
+    reachable = np.zeros(support.shape[0], dtype=bool)
+    reachable[init] = True
+    for _ in range(horizon - 1):
+        reachable |= support[reachable].any(axis=0)
+    frontier = support[reachable].any(axis=0) & ~reachable
+    return reachable, frontier
+
+
+def reachable_model(lb, ub, constants, init, horizon):
+    """
+    Only the states reachable from init within horizon steps under the interval support.
+    States first reached after exactly horizon steps are made absorbing, as a bounded property cannot observe their successors.
+    """
+    support = ub > 0
+    reachable, frontier = reachable_sets(support, init, horizon)
+    inner_states = np.flatnonzero(reachable)
+    frontier_states = np.flatnonzero(frontier)
+    model_index = np.full(lb.shape[0], -1)
+    model_index[inner_states] = np.arange(len(inner_states))
+    model_index[frontier_states] = len(inner_states) + np.arange(len(frontier_states))
+    blocks = [
+        (support[inner_states], lb[inner_states], ub[inner_states], model_index),
+        absorbing_block(model_index[frontier_states]),
+    ]
+    constants = np.concatenate((constants[inner_states], constants[frontier_states]))
+    return csr_model(blocks, constants, model_index[init])
+
+
+def unfolded_layers(support, init, horizon):
+    """Returns the states reachable in exactly j steps for j < horizon."""
+    layers = [np.array([init])]
+    for _ in range(horizon - 1):
+        layers.append(np.flatnonzero(support[layers[-1]].any(axis=0)))
+    return layers
+
+
+def unfolded_model(lb, ub, constants, init, horizon, lump=True):
+    """
+    Time-unfolded model of the first horizon steps from init.
+    Layer j holds the states reachable in exactly j steps, with intervals only towards layer j + 1.
+    The last layer is absorbing and, if lump is True, its states are merged when they have the same C constants.
+    The intervals towards a merged state are [sum of lb, sum of ub] over its members, which is exact for robust values that only depend on the constants.
+    """
+    support = ub > 0
+    layers = unfolded_layers(support, init, horizon)
+    if lump:
+        last_constants, group = np.unique(constants, axis=0, return_inverse=True)
+        group = group.reshape(-1)
+    else:
+        last_constants, group = constants, np.arange(lb.shape[0])
+    members = np.zeros((lb.shape[0], last_constants.shape[0]))
+    members[np.arange(lb.shape[0]), group] = 1
+    last_support = support[layers[-1]] @ members > 0
+    used_groups = np.flatnonzero(last_support.any(axis=0))
+    members = members[:, used_groups]
+    offsets = np.cumsum([0] + [len(layer) for layer in layers])
+    blocks = []
+    for j, layer in enumerate(layers[:-1]):
+        next_layer = layers[j + 1]
+        columns = offsets[j + 1] + np.arange(len(next_layer))
+        blocks.append((support[np.ix_(layer, next_layer)], lb[np.ix_(layer, next_layer)], ub[np.ix_(layer, next_layer)], columns))
+    group_states = offsets[-1] + np.arange(len(used_groups))
+    blocks.append((
+        last_support[:, used_groups],
+        lb[layers[-1]] @ members,
+        np.minimum(1, ub[layers[-1]] @ members),
+        group_states,
+    ))
+    blocks.append(absorbing_block(group_states))
+    model_constants = np.concatenate([constants[layer] for layer in layers] + [last_constants[used_groups]])
+    return csr_model(blocks, model_constants, 0)
+
+
+def pruned_model(lb, ub, constants, init, horizon, lump=True):
+    """
+    Smallest of the reachable and the unfolded model for properties that only look horizon steps ahead.
+    Both preserve the robust values of such properties at init as long as they only depend on the constants.
+    """
+    horizon = max(1, horizon)
+    support = ub > 0
+    # number of intervals of both models, bounding each row of the last unfolded layer by the number of merged states
+    reachable, frontier = reachable_sets(support, init, horizon)
+    reachable_size = support[reachable].sum() + frontier.sum()
+    layers = unfolded_layers(support, init, horizon)
+    n_groups = len(np.unique(constants, axis=0)) if lump else lb.shape[0]
+    unfolded_size = sum(support[layer].sum() for layer in layers[:-1]) + (len(layers[-1]) + 1) * n_groups
+    if unfolded_size < reachable_size:
+        return unfolded_model(lb, ub, constants, init, horizon, lump)
+    return reachable_model(lb, ub, constants, init, horizon)
+
+
+########################################
+#          Symmetry reduction          #
+########################################
+
+def interchangeable_cells(n_cells, cell_labelling, state_cells):
+    """Groups of cells that belong to the same classes and have the same intracellular state space, as lists of cells."""
+    signatures = {}
+    for cell in range(n_cells):
+        classes = tuple(count for count, cells in enumerate(cell_labelling) if cell in cells)
+        signatures.setdefault((classes, state_cells[:, cell].max()), []).append(cell)
+    return [cells for cells in signatures.values() if len(cells) >= 2]
+
+
+class CellSymmetries:
+
+    """Permutations of the tabular states that permute interchangeable cells.
+    A model that is invariant under them can be lumped into one state per orbit,
+    which preserves properties that only count cells through n and n_<class>.
+    """
+
+    def __init__(self, state_cells, state_weights, cell_groups):
+        """
+        state_cells: array of shape (n_states, n_cells) with the intracellular states of every tabular state
+        state_weights: weights such that state_cells @ state_weights are the tabular states
+        cell_groups: lists of interchangeable cells
+        """
+        # swaps of neighbouring cells in a group generate all permutations within the group
+        self.generators = []
+        for cells in cell_groups:
+            for cell, next_cell in zip(cells[:-1], cells[1:]):
+                swapped = state_cells.copy()
+                swapped[:, [cell, next_cell]] = state_cells[:, [next_cell, cell]]
+                self.generators.append(swapped @ state_weights)
+        # the representative of an orbit has the intracellular states of each group in increasing order
+        canonical = state_cells.copy()
+        for cells in cell_groups:
+            canonical[:, cells] = np.sort(state_cells[:, cells], axis=1)
+        self.representatives, self.orbits = np.unique(canonical @ state_weights, return_inverse=True)
+        self.orbits = self.orbits.reshape(-1)
+
+    def n_orbits(self):
+        return len(self.representatives)
+
+    def is_invariant(self, lb, ub, counts, tolerance=1e-12):
+        """
+        Whether the counts of the formulas are unchanged by every permutation, and the bounds up to tolerance.
+        The tolerance absorbs rounding, e.g. products of cell probabilities that are multiplied in a different order.
+        """
+        if len(self.generators) == 0:
+            return False
+        # the row sums are a cheap necessary condition before comparing the whole matrices
+        row_sums = ub.sum(axis=1)
+        for permutation in self.generators:
+            if not np.allclose(row_sums[permutation], row_sums):
+                return False
+        for permutation in self.generators:
+            if not (
+                np.array_equal(counts[permutation], counts)
+                and np.allclose(lb[np.ix_(permutation, permutation)], lb, rtol=0, atol=tolerance)
+                and np.allclose(ub[np.ix_(permutation, permutation)], ub, rtol=0, atol=tolerance)
+            ):
+                return False
+        return True
+
+    def lump(self, lb, ub, constants, init):
+        """
+        Returns the bounds, constants and initial state of the model with one state per orbit.
+        The intervals towards an orbit are [sum of lb, sum of ub] over its members, which is exact for invariant models.
+        """
+        members = np.zeros((lb.shape[0], self.n_orbits()))
+        members[np.arange(lb.shape[0]), self.orbits] = 1
+        return (
+            lb[self.representatives] @ members,
+            np.minimum(1, ub[self.representatives] @ members),
+            constants[self.representatives],
+            self.orbits[init],
+        )
+
+
+def property_names(props):
+    """Identifiers in a property, which include the variables and formulas it refers to."""
+    return set(re.findall(r'[A-Za-z_][A-Za-z_0-9]*', props))
+
+
+########################################
+#            Model writers             #
+########################################
+
+def model_formulas(n_cells, cell_classes, cell_labelling):
+    """Formulas of the model file as a dict from names to PRISM expressions."""
+    formulas = {'n': ''.join('c_' + str(cell) + ' + ' for cell in range(n_cells)) + '0'}
+    for count, cell_class in enumerate(cell_classes):
+        formulas['n_' + cell_class] = ''.join('c_' + str(cell) + ' + ' for cell in cell_labelling[count]) + '0'
+    return formulas
+
+
+def substitute_formulas(props, formulas):
+    """Replaces formulas by their expressions, as the explicit format has no formulas."""
+    for name, expression in formulas.items():
+        props = re.sub(r'\b' + name + r'\b', '(' + expression + ')', props)
+    return props
+
+
+def interval_strings(model, positions=None):
+    """The intervals of all transitions, or of those at positions, formatted as '[lb,ub]'."""
+    lb, ub = (model.lb, model.ub) if positions is None else (model.lb[positions], model.ub[positions])
+    # formatting whole lists is faster than formatting numpy scalars or using numpy string operations
+    return ['[' + lb + ',' + ub + ']' for lb, ub in zip(map(repr, lb.tolist()), map(repr, ub.tolist()))]
+
+
+def changed_rows(last_model, model):
+    """Model states whose intervals differ between two models with the same transition structure."""
+    changed = np.flatnonzero((model.lb != last_model.lb) | (model.ub != last_model.ub))
+    return np.unique(np.searchsorted(model.indptr, changed, side='right') - 1)
+
+
+class PrismLanguageWriter:
+
+    """Writes models in the PRISM language, with variables s and c_i and the constants C<s>_<i> for the values of c_i.
+    The lines of the last model are kept. If the next model has the same transition structure,
+    only the lines of the states whose intervals or constants changed are regenerated.
+    Consecutive checks in the shield typically differ in the states where one cell changes its action.
+    """
+
+    def __init__(self):
+        self.last_model = None
+        self.constant_lines = []
+        self.transition_lines = []
+        self.n_written_rows = 0 # number of regenerated lines in the last write, for diagnostics
+
+    def same_structure(self, model):
+        last_model = self.last_model
+        return (
+            last_model is not None
+            and last_model.constants.shape == model.constants.shape
+            and np.array_equal(last_model.indptr, model.indptr)
+            and np.array_equal(last_model.indices, model.indices)
+        )
+
+    def write(self, model, formulas):
+        n_cells = model.constants.shape[1]
+        if self.same_structure(model):
+            constant_rows = np.flatnonzero((model.constants != self.last_model.constants).any(axis=1))
+            transition_rows = changed_rows(self.last_model, model)
+        else:
+            self.constant_names = [['C' + str(x) + '_' + str(cell) for cell in range(n_cells)] for x in range(model.n_states)]
+            # the updates towards each model state, shared by all transitions into it
+            self.updates = [
+                " : (s' = " + str(x) + ')' + ''.join(" & (c_" + str(cell) + "' = " + names[cell] + ')' for cell in range(n_cells))
+                for x, names in enumerate(self.constant_names)
+            ]
+            self.constant_lines = [None] * model.n_states
+            self.transition_lines = [None] * model.n_states
+            constant_rows = transition_rows = np.arange(model.n_states)
+        self.write_constant_lines(model, constant_rows.tolist())
+        self.write_transition_lines(model, transition_rows.tolist())
+        self.n_written_rows = len(constant_rows) + len(transition_rows)
+        self.last_model = model
+        buffer = ['dtmc\n\n']
+        buffer.extend(self.constant_lines)
+        buffer.append('\nmodule M\n\n')
+        buffer.append('s : [0..' + str(model.n_states) + '] init ' + str(model.init) + ';\n')
+        buffer.extend('c_' + str(cell) + ' : [0..1] init ' + self.constant_names[model.init][cell] + ';\n' for cell in range(n_cells))
+        buffer.append('\n')
+        buffer.extend(self.transition_lines)
+        buffer.append('\nendmodule\n\n')
+        buffer.extend('formula ' + name + ' = ' + expression + ';\n' for name, expression in formulas.items())
+        return ''.join(buffer)
+
+    def write_constant_lines(self, model, rows):
+        constants = model.constants[rows].tolist()
+        for x, row_constants in zip(rows, constants):
+            self.constant_lines[x] = ''.join(
+                'const int ' + name + ' = ' + str(constant) + ';\n' for name, constant in zip(self.constant_names[x], row_constants)
+            )
+
+    def write_transition_lines(self, model, rows):
+        indptr = model.indptr.tolist()
+        if len(rows) == model.n_states:
+            positions = None
+        else:
+            positions = np.concatenate([np.arange(indptr[x], indptr[x + 1]) for x in rows] + [np.zeros(0, dtype=int)])
+        intervals = interval_strings(model, positions)
+        next_states = model.indices.tolist() if positions is None else model.indices[positions].tolist()
+        transitions = [interval + self.updates[next_x] for interval, next_x in zip(intervals, next_states)]
+        start = 0
+        for x in rows:
+            stop = start + indptr[x + 1] - indptr[x]
+            self.transition_lines[x] = '[] (s = ' + str(x) + ') -> ' + ' + '.join(transitions[start:stop]) + ';\n'
+            start = stop
+
+
+def prism_language(model, formulas):
+    """The model in the PRISM language, see PrismLanguageWriter."""
+    return PrismLanguageWriter().write(model, formulas)
+
+
+def explicit_files(model):
+    """
+    The model in PRISM's explicit format as a dict from file extensions to contents, to be imported as an interval DTMC.
+    The .sta file has the variables s and c_i of the PRISM language model, and the .lab file only marks the initial state.
+    """
+    n_cells = model.constants.shape[1]
+    rows = np.repeat(np.arange(model.n_states), np.diff(model.indptr)).tolist()
+    tra = [str(x) + ' ' + str(next_x) + ' ' + interval for x, next_x, interval in zip(rows, model.indices.tolist(), interval_strings(model))]
+    sta = [str(x) + ':(' + str(x) + ''.join(',' + str(c) for c in constants) + ')' for x, constants in enumerate(model.constants.tolist())]
+    return {
+        'tra': str(model.n_states) + ' ' + str(model.n_intervals()) + '\n' + '\n'.join(tra) + '\n',
+        'sta': '(s' + ''.join(',c_' + str(cell) for cell in range(n_cells)) + ')\n' + '\n'.join(sta) + '\n',
+        'lab': '0="init"\n' + str(model.init) + ': 0\n',
+    }
@@ -0,0 +1,184 @@
+import atexit
+import os
+import subprocess
+import tempfile
+
+
+class PrismError(Exception):
+    pass
+
+
+class PrismServer:
+
+    """A single PRISM process that is kept alive between verifications.
+    Launching the PRISM script starts a new JVM for every check, which dominates the time spent in the shield.
+    The server instead reads one model file and one properties file per line on stdin and answers on stdout, in order.
+    If the process dies it is restarted on the next check.
+    """
+
+    source_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prism_server')
+    build_dir = '.prism_tmps/prism_server/'
+
+    def __init__(self, prism_dir='prism/prism'):
+        self.prism_dir = prism_dir
+        self.process = None
+        # requests are numbered in the order they are sent, answers that were read but not yet received are kept by number
+        self.n_sent = 0
+        self.n_received = 0
+        self.answers = {}
+
+    def classpath(self):
+        paths = [
+            os.path.join(self.prism_dir, 'lib', 'prism.jar'),
+            os.path.join(self.prism_dir, 'classes'),
+            self.prism_dir,
+            os.path.join(self.prism_dir, 'lib', '*'),
+        ]
+        return os.pathsep.join(paths)
+
+    def compile(self):
+        if os.path.isfile(self.build_dir + 'PrismServer.class'):
+            return
+        os.makedirs(self.build_dir, exist_ok=True)
+        # compile in a private directory so that concurrent runs never see a partially written class file
+        tmp_dir = tempfile.mkdtemp(dir=self.build_dir)
+        command = [
+            'javac',
+            '-cp', self.classpath(),
+            '-d', tmp_dir,
+            os.path.join(self.source_dir, 'PrismServer.java'),
+        ]
+        try:
+            subprocess.run(command, check=True, capture_output=True)
+        except (OSError, subprocess.CalledProcessError) as error:
+            raise PrismError('Could not compile the PRISM server: ' + str(error))
+        os.replace(os.path.join(tmp_dir, 'PrismServer.class'), self.build_dir + 'PrismServer.class')
+        os.rmdir(tmp_dir)
+
+    def start(self):
+        self.compile()
+        lib_dir = os.path.join(self.prism_dir, 'lib')
+        env = dict(os.environ)
+        env['LD_LIBRARY_PATH'] = lib_dir + os.pathsep + env.get('LD_LIBRARY_PATH', '')
+        env['DYLD_LIBRARY_PATH'] = lib_dir + os.pathsep + env.get('DYLD_LIBRARY_PATH', '')
+        command = [
+            'java',
+            '-Xmx1g',
+            '-Xss4m',
+            '-Djava.library.path=' + lib_dir,
+            '-cp', self.build_dir + os.pathsep + self.classpath(),
+            'PrismServer',
+        ]
+        try:
+            self.process = subprocess.Popen(
+                command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                env=env,
+                text=True,
+                bufsize=1,
+            )
+        except OSError as error:
+            self.process = None
+            raise PrismError('Could not start the PRISM server: ' + str(error))
+        if self.process.stdout.readline().strip() != 'READY':
+            self.close()
+            raise PrismError('The PRISM server failed to initialise.')
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def check(self, model_path, props_path):
+        """Returns the Boolean result of checking the single property in props_path on the model in model_path."""
+        return self.check_batch([(model_path, props_path)])[0]
+
+    def check_batch(self, paths):
+        """
+        paths: list of (model path, properties path) pairs
+        All requests are sent before the first answer is read, so the batch costs a single round trip.
+        """
+        answers = [self.receive(ticket) for ticket in self.send(paths)]
+        for verified, error_message in answers:
+            if error_message != '':
+                with open('.prism_tmps/error.txt', 'a') as error_file:
+                    error_file.write(error_message + '\n')
+                raise PrismError('Prism returned an error. See ".prism_tmps/error.txt" for details.')
+        return [verified for verified, _ in answers]
+
+    def send(self, paths):
+        """
+        Sends the requests of paths, a list of (model path, properties path) pairs, without waiting for the answers.
+        Returns a ticket per request for receive. The server checks the requests in order while the caller goes on.
+        """
+        if not self.is_alive():
+            self.close() # the requests that were sent to a stopped process are never answered
+            self.start()
+        try:
+            self.process.stdin.write(''.join(
+                os.path.abspath(model_path) + '\t' + os.path.abspath(props_path) + '\n' for model_path, props_path in paths
+            ))
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError):
+            self.close()
+            raise PrismError('The PRISM server stopped during verification.')
+        tickets = list(range(self.n_sent, self.n_sent + len(paths)))
+        self.n_sent += len(paths)
+        return tickets
+
+    def receive(self, ticket):
+        """
+        Returns the Boolean result of the request with the ticket and the error message of PRISM, which is empty on success.
+        The answers to earlier requests are read and kept until they are received.
+        """
+        while self.n_received <= ticket:
+            try:
+                answer = self.process.stdout.readline()
+            except OSError:
+                answer = ''
+            if answer == '':
+                self.close()
+                break
+            kind, _, message = answer.strip().partition(' ')
+            self.answers[self.n_received] = (message == 'true', '') if kind == 'RESULT' else (False, message)
+            self.n_received += 1
+        if ticket not in self.answers:
+            raise PrismError('The PRISM server stopped during verification.')
+        return self.answers.pop(ticket)
+
+    def close(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+        self.process = None
+        self.n_received = self.n_sent # the pending requests are lost
+
+
+# One server per process, forked workers start their own.
+prism_servers = {}
+failed_prism_servers = set()
+
+def get_prism_server(prism_dir='prism/prism'):
+    """Returns the PRISM server of this process, or None if it cannot be started."""
+    pid = os.getpid()
+    if pid in failed_prism_servers:
+        return None
+    if pid not in prism_servers:
+        server = PrismServer(prism_dir)
+        try:
+            server.start()
+        except PrismError:
+            failed_prism_servers.add(pid)
+            return None
+        prism_servers[pid] = server
+    return prism_servers[pid]
+
+@atexit.register
+def close_prism_servers():
+    server = prism_servers.pop(os.getpid(), None)
+    if server is not None:
+        server.close()
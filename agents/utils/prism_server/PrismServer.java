@@ -0,0 +1,53 @@
+import java.io.BufferedReader;
+import java.io.File;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+
+import parser.ast.ModulesFile;
+import parser.ast.PropertiesFile;
+import prism.Prism;
+import prism.PrismDevNullLog;
+import prism.Result;
+
+/**
+ * Long-lived PRISM worker used by agents/utils/prism.py.
+ * Each line on stdin is a model file and a properties file separated by a tab.
+ * Each answer on stdout is either "RESULT true", "RESULT false" or "ERROR <message>".
+ */
+public class PrismServer
+{
+	public static void main(String[] args) throws Exception
+	{
+		PrintStream out = new PrintStream(System.out, true);
+		// PRISM may print to System.out, keep it away from the protocol
+		System.setOut(new PrintStream(System.err, true));
+		Prism prism = new Prism(new PrismDevNullLog());
+		prism.initialise();
+		BufferedReader in = new BufferedReader(new InputStreamReader(System.in));
+		out.println("READY");
+		String line;
+		while ((line = in.readLine()) != null) {
+			String[] paths = line.split("\t");
+			try {
+				if (paths.length != 2) {
+					throw new IllegalArgumentException("expected a model file and a properties file");
+				}
+				ModulesFile modulesFile = prism.parseModelFile(new File(paths[0]));
+				prism.loadPRISMModel(modulesFile);
+				PropertiesFile propertiesFile = prism.parsePropertiesFile(modulesFile, new File(paths[1]));
+				if (propertiesFile.getNumProperties() != 1) {
+					throw new IllegalArgumentException("verification returned " + propertiesFile.getNumProperties() + " results, expected 1 Boolean result");
+				}
+				Result result = prism.modelCheck(propertiesFile, propertiesFile.getPropertyObject(0));
+				if (result.getResult() instanceof Boolean) {
+					out.println("RESULT " + result.getResult());
+				} else {
+					out.println("ERROR verification returned non-Boolean result");
+				}
+			} catch (Exception error) {
+				out.println("ERROR " + String.valueOf(error.getMessage()).replace('\n', ' '));
+			}
+		}
+		prism.closeDown();
+	}
+}
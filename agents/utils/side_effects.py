@@ -0,0 +1,25 @@
+import numpy as np
+
+
+# The side-effects status of an intracellular state is a bitmask of the side effects it may still have.
+# It starts as UNKNOWN and reports clear the bit of the side effect that was ruled out.
+SAFE = 1
+UNSAFE = 2
+UNKNOWN = SAFE | UNSAFE
+
+
+def side_effects_status_update(side_effects_status, reported_states, side_effects):
+    """
+    Applies the reports of one step in place and returns whether the status changed.
+    side_effects_status: uint8 array with the status of every intracellular state
+    reported_states: the current intracellular state of every cell
+    side_effects: array of shape (n_cells, n_cells) with the report of each reporting cell (rows) on each reported cell (columns)
+    A 'safe' report rules out unsafe and an 'unsafe' report rules out safe, regardless of the order of the reports.
+    """
+    side_effects = np.asarray(side_effects)
+    reported_states = np.asarray(reported_states)
+    before = side_effects_status[reported_states]
+    # clearing a bit is idempotent, so repeated states in the index arrays are harmless
+    side_effects_status[reported_states[(side_effects == 'safe').any(axis=0)]] &= ~np.uint8(UNSAFE)
+    side_effects_status[reported_states[(side_effects == 'unsafe').any(axis=0)]] &= ~np.uint8(SAFE)
+    return bool((side_effects_status[reported_states] != before).any())
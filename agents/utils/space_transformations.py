@@ -20,4 +20,91 @@ def tabular2cellular(anint, intracellular_size, n_cells):
     for cell in range(n_cells):
         alist[cell] = anint % intracellular_size
         anint = anint // intracellular_size
-    return alist
\ No newline at end of file
+    return alist
+
+class CellularIndexTables:
+
+    """Integer lookup arrays between tabular and cellular states and actions.
+    They are built once and replace calls to tabular2cellular and cellular2tabular in the inner loops of the agents.
+    """
+
+    def __init__(self, n_states, n_actions, state_space, action_space, tabular2cellular):
+        """
+        tabular2cellular: function mapping a tabular element and its space to the array of cellular components
+        """
+        self.state_cells = np.array(
+            [tabular2cellular(s, state_space) for s in range(n_states)],
+            dtype=int,
+        ) # the cellular components of every tabular state
+        self.action_cells = np.array(
+            [tabular2cellular(a, action_space) for a in range(n_actions)],
+            dtype=int,
+        ) # the cellular components of every tabular action
+        self.n_cells = self.state_cells.shape[1]
+        self.state_weights = mixed_radix_weights(self.state_cells)
+        self.action_weights = mixed_radix_weights(self.action_cells)
+        self.n_intracellular_actions = int(np.max(self.action_cells)) + 1
+        # the flat intracellular pair si * n_intracellular_actions + ai of each cell for every flat joint pair s * n_actions + a
+        self.pair_cells = self.intracellular_pairs(
+            self.state_cells[:, np.newaxis, :],
+            self.action_cells[np.newaxis, :, :],
+        ).reshape(n_states * n_actions, self.n_cells)
+        # inverted index from flat intracellular pairs to the flat joint pairs containing them
+        intracellular_pairs = self.pair_cells.reshape(-1)
+        joint_pairs = np.repeat(np.arange(n_states * n_actions), self.n_cells)
+        order = np.lexsort((joint_pairs, intracellular_pairs))
+        intracellular_pairs, joint_pairs = intracellular_pairs[order], joint_pairs[order]
+        distinct = np.ones(len(order), dtype=bool)
+        distinct[1:] = (intracellular_pairs[1:] != intracellular_pairs[:-1]) | (joint_pairs[1:] != joint_pairs[:-1])
+        self.joint_indices = joint_pairs[distinct]
+        self.joint_pointers = np.zeros((np.max(self.state_cells) + 1) * self.n_intracellular_actions + 1, dtype=int)
+        np.cumsum(
+            np.bincount(intracellular_pairs[distinct], minlength=len(self.joint_pointers) - 1),
+            out=self.joint_pointers[1:],
+        )
+
+    def tabular_states(self, cellular_states):
+        """The last axis of cellular_states is over cells."""
+        return np.asarray(cellular_states) @ self.state_weights
+
+    def tabular_actions(self, cellular_actions):
+        """The last axis of cellular_actions is over cells."""
+        return np.asarray(cellular_actions) @ self.action_weights
+
+    def intracellular_pairs(self, cellular_states, cellular_actions):
+        """Flat indices si * n_intracellular_actions + ai of the intracellular pairs."""
+        return np.asarray(cellular_states) * self.n_intracellular_actions + np.asarray(cellular_actions)
+
+    def joint_pairs_containing(self, intracellular_pairs):
+        """Flat indices s * n_actions + a of the joint pairs containing at least one of the flat intracellular pairs."""
+        intracellular_pairs = np.unique(intracellular_pairs)
+        if len(intracellular_pairs) == 1:
+            return self.joint_indices[self.joint_pointers[intracellular_pairs[0]]:self.joint_pointers[intracellular_pairs[0] + 1]]
+        return np.unique(
+            np.concatenate(
+                [self.joint_indices[self.joint_pointers[pair]:self.joint_pointers[pair + 1]] for pair in intracellular_pairs]
+                + [np.zeros(0, dtype=int)]
+            )
+        )
+
+    def tabular_state(self, cellular_state):
+        return int(self.tabular_states(cellular_state))
+
+    def tabular_action(self, cellular_action):
+        return int(self.tabular_actions(cellular_action))
+
+
+def mixed_radix_weights(cells):
+
+    """Weights w such that cells[x] @ w == x for the table of cellular components of all tabular elements."""
+
+    n_cells = cells.shape[1]
+    weights = np.zeros(n_cells, dtype=int)
+    for cell in range(n_cells):
+        unit = np.zeros(n_cells, dtype=int)
+        unit[cell] = 1
+        matches = np.nonzero(np.all(cells == unit, axis=1))[0]
+        if len(matches) == 1:
+            weights[cell] = matches[0]
+    assert (cells @ weights == np.arange(cells.shape[0])).all(), 'the tabular encoding is not mixed-radix'
+    return weights
@@ -0,0 +1,72 @@
+from collections import OrderedDict
+import hashlib
+import numpy as np
+import os
+import pickle as pkl
+
+
+class VerificationCache:
+
+    """Least-recently-used cache of verification results.
+    Keys are hashes of everything that determines the outcome of a verification, see verification_key.
+    The cache can optionally be stored on disk so that continued runs start with the results of earlier runs.
+    """
+
+    def __init__(self, max_size=10000, path=None):
+        """
+        max_size: maximum number of stored results, the least recently used result is evicted first
+        path: file to load the cache from and to dump it to, or None to keep it in memory only
+        """
+        self.max_size = max_size
+        self.path = path
+        self.results = OrderedDict()
+        self.n_unsaved = 0
+        if path is not None:
+            self.load()
+
+    def get(self, key):
+        """Returns the stored result or None if there is none."""
+        if key in self.results:
+            self.results.move_to_end(key)
+            return self.results[key]
+        return None
+
+    def put(self, key, verified):
+        self.results[key] = verified
+        self.results.move_to_end(key)
+        while len(self.results) > self.max_size:
+            self.results.popitem(last=False)
+        self.n_unsaved += 1
+
+    def load(self):
+        if os.path.isfile(self.path):
+            with open(self.path, 'rb') as cache_file:
+                results = pkl.load(cache_file)
+            for key, verified in results.items():
+                self.put(key, verified)
+            self.n_unsaved = 0
+
+    def dump(self):
+        if self.path is None or self.n_unsaved == 0:
+            return
+        # write to a temporary file first so that an interrupted dump never corrupts the cache
+        tmp_path = self.path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_path, 'wb') as cache_file:
+            pkl.dump(self.results, cache_file)
+        os.replace(tmp_path, self.path)
+        self.n_unsaved = 0
+
+
+def verification_key(*parts):
+    """Stable hash of arrays and strings, the shape and dtype of arrays are part of the key."""
+    key = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        if isinstance(part, str):
+            key.update(b's')
+            key.update(part.encode())
+        else:
+            part = np.ascontiguousarray(part)
+            key.update(b'a')
+            key.update(str((part.dtype.str, part.shape)).encode())
+            key.update(part.tobytes())
+    return key.hexdigest()
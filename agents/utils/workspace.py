@@ -0,0 +1,61 @@
+import os
+import shutil
+import tempfile
+import weakref
+
+
+class Workspace:
+
+    """Scratch directory of one agent for the files that are exchanged with PRISM.
+    The directory is created once per process, on a RAM-backed file system when there is one, and is reused for every verification.
+    Files are rewritten in place, and the directory is removed when the workspace is garbage collected or the process exits.
+    Only paths are stored, so agents that hold a workspace can still be pickled, an unpickled copy creates its own directory.
+    """
+
+    ram_dirs = ['/dev/shm']
+
+    def __init__(self, root=None, prefix='prism_'):
+        """
+        root: directory to create the scratch directory in, None picks a RAM-backed one if available and the default temporary directory otherwise
+        prefix: prefix of the name of the scratch directory
+        """
+        self.root = root
+        self.prefix = prefix
+        self.directory = None
+        self.pid = None
+        self.contents = {}
+
+    def root_dir(self):
+        if self.root is not None:
+            return self.root
+        for ram_dir in self.ram_dirs:
+            if os.path.isdir(ram_dir) and os.access(ram_dir, os.W_OK):
+                return ram_dir
+        return None # tempfile picks the default
+
+    def path(self, subdirectory=''):
+        """Returns the path of the scratch directory, or of one of its subdirectories, with a trailing slash."""
+        if self.pid != os.getpid() or not os.path.isdir(self.directory):
+            # mkdtemp picks a fresh name instead of waiting for a colliding directory to disappear
+            self.directory = tempfile.mkdtemp(prefix=self.prefix, dir=self.root_dir())
+            self.pid = os.getpid()
+            self.contents = {}
+            weakref.finalize(self, remove_workspace_dir, self.pid, self.directory)
+        path = os.path.join(self.directory, subdirectory, '')
+        if subdirectory != '':
+            os.makedirs(path, exist_ok=True)
+        return path
+
+    def write(self, file_path, contents):
+        """Writes contents to file_path unless the file already has them, which saves rewriting files that rarely change."""
+        if self.contents.get(file_path) == contents and os.path.isfile(file_path):
+            return
+        with open(file_path, 'w') as file:
+            file.write(contents)
+        self.contents[file_path] = contents
+
+
+def remove_workspace_dir(pid, directory):
+    # forked processes inherit the finalizers of their parent but must not remove its directories
+    if pid == os.getpid():
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,42 @@
+import itertools
+
+import numpy as np
+import pytest
+
+pytest.importorskip('gym_cellular') # the agents package imports the environment package
+
+from agents.utils.factored_transitions import FactoredTransitions
+from agents.utils.kernels import optimistic_expectations
+
+
+def random_model(n_cells=3, n_intracellular_states=3, n_intracellular_actions=2, seed=0):
+    rng = np.random.RandomState(seed)
+    intracellular = rng.dirichlet(np.ones(n_intracellular_states) * .5, size=(n_intracellular_states, n_intracellular_actions))
+    intracellular[0, 1] = 0 # an unvisited pair
+    state_cells = np.array(list(itertools.product(range(n_intracellular_states), repeat=n_cells)))
+    action_cells = np.array(list(itertools.product(range(n_intracellular_actions), repeat=n_cells)))
+    factored = FactoredTransitions(intracellular, state_cells, action_cells)
+    joint = factored[np.arange(len(state_cells))[:, np.newaxis], np.arange(len(action_cells))[np.newaxis, :]]
+    return factored, joint, rng
+
+
+def test_expectations_match_joint_rows():
+    factored, joint, rng = random_model()
+    u = rng.rand(joint.shape[2])
+    assert np.allclose(factored.expectations(u), joint @ u)
+
+
+@pytest.mark.parametrize('scale', [10, 1, .1, .01, 0])
+@pytest.mark.parametrize('block_entries', [2 ** 20, 5, 1])
+def test_optimistic_expectations_are_exact(scale, block_entries, monkeypatch):
+    monkeypatch.setattr(FactoredTransitions, 'block_entries', block_entries)
+    factored, joint, rng = random_model()
+    p_distances = rng.rand(*joint.shape[:2]) * scale
+    u = rng.rand(joint.shape[2])
+    for sorted_indices in [np.argsort(u), rng.permutation(len(u))]:
+        assert np.allclose(
+            factored.optimistic_expectations(p_distances, u, sorted_indices),
+            optimistic_expectations(joint, p_distances, sorted_indices, u),
+            rtol=0,
+            atol=1e-12,
+        )
@@ -0,0 +1,124 @@
+import itertools
+import os
+import pickle as pkl
+import subprocess
+
+import numpy as np
+import pytest
+
+pytest.importorskip('gym_cellular') # the agents package imports the environment package
+
+from agents.utils.interval_dtmc import IntervalDtmc, parse_bounded_property
+from agents.utils.model_export import full_model, model_formulas, prism_language
+
+prism_bin = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'prism', 'prism', 'bin', 'prism')
+
+# two cells of two classes, as in the models of PeUcrlAgt
+n_cells = 2
+cell_classes = ['children', 'adults']
+cell_labelling = [[0], [1]]
+variable_names = ['s', 'n', 'c_0', 'c_1', 'n_children', 'n_adults']
+
+
+def variables(constants):
+    """Same as PeUcrlAgt.model_variables."""
+    values = {'s': np.arange(constants.shape[0]), 'n': constants.sum(axis=1)}
+    for cell in range(n_cells):
+        values['c_' + str(cell)] = constants[:, cell]
+    for count, cell_class in enumerate(cell_classes):
+        values['n_' + cell_class] = constants[:, cell_labelling[count]].sum(axis=1)
+    return values
+
+
+def fixed_model(seed, distance):
+    rng = np.random.RandomState(seed)
+    n_states = 4
+    p = rng.dirichlet(np.ones(n_states), size=n_states)
+    lb = np.maximum(1e-15, p - distance)
+    ub = np.minimum(1 - 1e-15, p + distance)
+    constants = np.array(list(itertools.product([0, 1], repeat=n_cells)))
+    return lb, ub, constants
+
+
+def vertex_expectations(lb, ub, u, minimize):
+    """Optimal expectations over the vertices of the interval polytopes, where all but one probability is at a bound."""
+    values = []
+    for s in range(lb.shape[0]):
+        candidates = []
+        for free in range(len(u)):
+            others = [k for k in range(len(u)) if k != free]
+            for at_upper in itertools.product([False, True], repeat=len(others)):
+                p = np.empty(len(u))
+                p[others] = np.where(at_upper, ub[s, others], lb[s, others])
+                p[free] = 1 - p[others].sum()
+                if lb[s, free] - 1e-12 <= p[free] <= ub[s, free] + 1e-12:
+                    candidates.append(p @ u)
+        values.append(min(candidates) if minimize else max(candidates))
+    return np.array(values)
+
+
+@pytest.mark.parametrize('prism_props', [
+    'P>=0.5 [ X X n<=1 ]',
+    'P>=1 [ G<=5 n<=2 ] & P>=1 [ G<=3 n_children<=0] & P>=0.80 [ F<=20 n<=1 ]',
+    'P>=0.8 [ !(n>=2) U<=4 c_0=1 | s=3 ]',
+    'P<0.1 [ F<=2 n_adults+n_children>=2 ]',
+])
+def test_bounded_properties_are_parsed(prism_props):
+    assert parse_bounded_property(prism_props, variable_names) is not None
+
+
+@pytest.mark.parametrize('prism_props', [
+    'P>=1 [ G n<=2 ]', # unbounded
+    'P=? [ X n<=1 ]',
+    'P>=0.5 [ X X foo<=1 ]', # unknown name
+    'N/A',
+    'none',
+])
+def test_other_properties_are_not_parsed(prism_props):
+    assert parse_bounded_property(prism_props, variable_names) is None
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_robust_expectations_are_optimal(seed):
+    lb, ub, constants = fixed_model(seed, .3)
+    model = IntervalDtmc(lb, ub, 0, variables(constants))
+    u = np.random.RandomState(seed).rand(lb.shape[0])
+    for minimize in [True, False]:
+        assert np.allclose(model.robust_expectations(u, minimize), vertex_expectations(lb, ub, u, minimize))
+
+
+def test_parsed_property_pickles():
+    bounded_property = parse_bounded_property('P>=0.5 [ X X n<=1 ] & P>=0.8 [ !(n>=2) U<=4 c_0=1 ]', variable_names)
+    copy = pkl.loads(pkl.dumps(bounded_property))
+    assert copy.operators == bounded_property.operators
+    assert copy.horizon == bounded_property.horizon == 4
+    for seed in range(5):
+        lb, ub, constants = fixed_model(seed, .2)
+        model = IntervalDtmc(lb, ub, 0, variables(constants))
+        assert copy.check(model) == bounded_property.check(model)
+
+
+def prism_verdict(tmp_path, lb, ub, constants, init, prism_props):
+    model_path = tmp_path / 'model.prism'
+    props_path = tmp_path / 'constraints.props'
+    model_path.write_text(prism_language(full_model(lb, ub, constants, init), model_formulas(n_cells, cell_classes, cell_labelling)))
+    props_path.write_text(prism_props)
+    output = subprocess.check_output([prism_bin, str(model_path), str(props_path)]).decode()
+    results = [line for line in output.splitlines() if 'Result:' in line]
+    assert len(results) == 1
+    return 'true' in results[0]
+
+
+@pytest.mark.skipif(not os.path.isfile(prism_bin), reason='PRISM is not built')
+@pytest.mark.parametrize('prism_props', [
+    'P>=0.5 [ X X n<=1 ]',
+    'P>=0.05 [ G<=3 n_children<=0 ]',
+    'P>=0.4 [ F<=2 n>=2 ]',
+    'P<0.9 [ !(n>=2) U<=3 c_1=1 ]',
+])
+@pytest.mark.parametrize('seed, distance', [(0, 0.), (1, .05), (2, .2), (3, .5)])
+def test_native_verdicts_agree_with_prism(tmp_path, prism_props, seed, distance):
+    lb, ub, constants = fixed_model(seed, distance)
+    model = IntervalDtmc(lb, ub, 0, variables(constants))
+    bounded_property = parse_bounded_property(prism_props, variable_names)
+    assert bounded_property.check(model) == prism_verdict(tmp_path, lb, ub, constants, 0, prism_props)
@@ -0,0 +1,128 @@
+import itertools
+import os
+import re
+import subprocess
+
+import numpy as np
+import pytest
+
+pytest.importorskip('gym_cellular') # the agents package imports the environment package
+
+from agents.utils.interval_dtmc import IntervalDtmc, parse_bounded_property
+from agents.utils.model_export import explicit_files, full_model, model_formulas, pruned_model, prism_language, substitute_formulas
+
+prism_bin = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'prism', 'prism', 'bin', 'prism')
+
+# three cells of two classes, as in the models of PeUcrlAgt
+n_cells = 3
+cell_classes = ['children', 'adults']
+cell_labelling = [[0], [1, 2]]
+formulas = model_formulas(n_cells, cell_classes, cell_labelling)
+
+properties = [
+    'P>=0.5 [ X X n<=1 ]',
+    'P>=0.05 [ G<=3 n_children<=0 ]',
+    'P>=0.4 [ F<=2 n>=2 ]',
+    'P<0.9 [ !(n>=2) U<=3 c_1=1 ]',
+]
+
+
+def random_models(seed, distance):
+    """A full model and a pruned model with the intervals of a random DTMC widened by distance."""
+    rng = np.random.RandomState(seed)
+    n_states = 2 ** n_cells
+    p = rng.dirichlet(np.ones(n_states) * .3, size=n_states)
+    lb = np.maximum(0, p - distance)
+    ub = np.minimum(1, p + distance)
+    ub[p == 0] = 0 # no transition
+    constants = np.array(list(itertools.product([0, 1], repeat=n_cells)))
+    init = rng.randint(n_states)
+    return [full_model(lb, ub, constants, init), pruned_model(lb, ub, constants, init, 2)]
+
+
+def read_explicit_files(files):
+    """Returns the dense bounds, the variables and the labelled states of explicit files."""
+    tra = files['tra'].splitlines()
+    n_states, n_intervals = map(int, tra[0].split())
+    assert len(tra) == n_intervals + 1
+    lb, ub = np.zeros((n_states, n_states)), np.zeros((n_states, n_states))
+    for line in tra[1:]:
+        x, next_x, interval = line.split()
+        lb[int(x), int(next_x)], ub[int(x), int(next_x)] = map(float, interval[1:-1].split(','))
+    sta = files['sta'].splitlines()
+    names = sta[0][1:-1].split(',')
+    values = np.array([[int(value) for value in line.partition(':')[2][1:-1].split(',')] for line in sta[1:]])
+    assert (np.array([int(line.partition(':')[0]) for line in sta[1:]]) == np.arange(n_states)).all()
+    variables = {name: values[:, i] for i, name in enumerate(names)}
+    lab = files['lab'].splitlines()
+    labels = dict(re.findall(r'(\d+)="([^"]*)"', lab[0]))
+    labelled = {labels[index]: [int(line.partition(':')[0]) for line in lab[1:] if index in line.partition(':')[2].split()] for index in labels}
+    return lb, ub, variables, labelled
+
+
+def formula_values(variables):
+    """Values of the formulas of the PRISM language model, which the explicit format does not have."""
+    values = dict(variables)
+    for name, expression in formulas.items():
+        values[name] = sum(variables[term.strip()] for term in expression.split('+') if term.strip() != '0')
+    return values
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_explicit_files_describe_the_model(seed):
+    for model in random_models(seed, .1):
+        lb, ub, variables, labelled = read_explicit_files(explicit_files(model))
+        model_lb, model_ub = model.dense_bounds()
+        assert (lb == model_lb).all() and (ub == model_ub).all()
+        assert (variables['s'] == np.arange(model.n_states)).all()
+        for cell in range(n_cells):
+            assert (variables['c_' + str(cell)] == model.constants[:, cell]).all()
+        assert labelled == {'init': [model.init]}
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('prism_props', properties)
+def test_explicit_files_give_the_verdicts_of_the_model(seed, prism_props):
+    for model in random_models(seed, .1):
+        lb, ub, variables, labelled = read_explicit_files(explicit_files(model))
+        bounded_property = parse_bounded_property(prism_props, list(formula_values(variables)))
+        model_lb, model_ub = model.dense_bounds()
+        variables_of_model = {'s': np.arange(model.n_states)}
+        variables_of_model.update({'c_' + str(cell): model.constants[:, cell] for cell in range(n_cells)})
+        assert bounded_property.check(IntervalDtmc(lb, ub, labelled['init'][0], formula_values(variables))) == bounded_property.check(
+            IntervalDtmc(model_lb, model_ub, model.init, formula_values(variables_of_model))
+        )
+
+
+def test_formulas_are_substituted():
+    assert substitute_formulas('P>=0.5 [ X X n<=1 ] & P>=1 [ G<=2 n_children<1 ]', formulas) == (
+        'P>=0.5 [ X X (c_0 + c_1 + c_2 + 0)<=1 ] & P>=1 [ G<=2 (c_0 + 0)<1 ]'
+    )
+
+
+def prism_verdict(arguments):
+    output = subprocess.check_output([prism_bin] + arguments).decode()
+    results = [line for line in output.splitlines() if 'Result:' in line]
+    assert len(results) == 1
+    return 'true' in results[0]
+
+
+@pytest.mark.skipif(not os.path.isfile(prism_bin), reason='PRISM is not built')
+@pytest.mark.parametrize('prism_props', properties)
+@pytest.mark.parametrize('seed, distance', [(0, 0.), (1, .05), (2, .2)])
+def test_explicit_files_agree_with_prism_language(tmp_path, prism_props, seed, distance):
+    # the same arguments as PeUcrlAgt.run_prism with model_format = 'explicit'
+    (tmp_path / 'language.props').write_text(prism_props)
+    (tmp_path / 'explicit.props').write_text(substitute_formulas(prism_props, formulas))
+    for model in random_models(seed, distance):
+        (tmp_path / 'model.prism').write_text(prism_language(model, formulas))
+        for extension, contents in explicit_files(model).items():
+            (tmp_path / ('model.' + extension)).write_text(contents)
+        assert prism_verdict([
+            '-importtrans', str(tmp_path / 'model.tra'),
+            '-importstates', str(tmp_path / 'model.sta'),
+            '-importlabels', str(tmp_path / 'model.lab'),
+            '-idtmc',
+            '-ex',
+            str(tmp_path / 'explicit.props'),
+        ]) == prism_verdict([str(tmp_path / 'model.prism'), str(tmp_path / 'language.props')])
@@ -0,0 +1,85 @@
+import pickle as pkl
+
+import numpy as np
+import pytest
+
+pytest.importorskip('gym_cellular') # the agents package imports the environment package
+
+from gym_cellular.envs.utils import generalized_cellular2tabular as cellular2tabular, generalized_tabular2cellular as tabular2cellular
+from agents import PeUcrlAgt
+
+
+class MultiDiscrete:
+
+    def __init__(self, nvec):
+        self.nvec = list(nvec)
+
+
+class PriorKnowledge:
+
+    """The prior knowledge that PeUcrlAgt reads from a cellular environment, for small random cellular MDPs."""
+
+    def __init__(self, n_cells=3, n_intracellular_states=3, n_intracellular_actions=2):
+        self.n_cells = n_cells
+        self.n_intracellular_states = n_intracellular_states
+        self.n_intracellular_actions = n_intracellular_actions
+        self.n_states = n_intracellular_states ** n_cells
+        self.n_actions = n_intracellular_actions ** n_cells
+        self.state_space = MultiDiscrete([n_intracellular_states] * n_cells)
+        self.action_space = MultiDiscrete([n_intracellular_actions] * n_cells)
+        self.initial_state = (0,) * n_cells
+        self.initial_safe_states = [(0,) * n_cells]
+        self.identical_intracellular_transitions = True
+        self.confidence_level = 0.95
+        self.cell_classes = ['children', 'adults']
+        self.cell_labelling = [[0], list(range(1, n_cells))]
+        self.intracellular_rewards = np.random.RandomState(0).rand(n_intracellular_states, n_intracellular_actions)
+
+    def reward_func(self, state, action, next_state):
+        return float(np.mean(self.intracellular_rewards[list(state), list(action)]))
+
+    def cellularize(self, element, space):
+        return np.array(element, dtype=int)
+
+    def decellularize(self, cellular_element, space):
+        return tuple(int(x) for x in cellular_element)
+
+    def tabularize(self, element, space):
+        return cellular2tabular(element, space)
+
+    def detabularize(self, tabular_element, space):
+        return tuple(tabular2cellular(tabular_element, space))
+
+    def initial_policy(self, state):
+        return (0,) * self.n_cells
+
+
+def train_steps(agt, prior_knowledge, n_steps, seed=1):
+    """Runs the agent on a random cellular MDP without unsafe states, EVI can take very long after action pruning."""
+    rng = np.random.RandomState(seed)
+    n_cells, n_intracellular_states = prior_knowledge.n_cells, prior_knowledge.n_intracellular_states
+    transitions = rng.dirichlet(np.ones(n_intracellular_states) * .5, size=(n_intracellular_states, prior_knowledge.n_intracellular_actions))
+    state = prior_knowledge.initial_state
+    for _ in range(n_steps):
+        action = agt.sample_action(state)
+        state = tuple(rng.choice(n_intracellular_states, p=transitions[si, ai]) for si, ai in zip(state, action))
+        side_effects = np.full((n_cells, n_cells), 'silent', dtype=object)
+        np.fill_diagonal(side_effects, 'safe')
+        agt.update(state, prior_knowledge.reward_func(state, action, None), {'side_effects': side_effects})
+        agt.get_data()
+    return state
+
+
+@pytest.mark.parametrize('shield_mode', ['sequential', 'batched', 'speculative'])
+def test_agent_with_bounded_property_pickles(shield_mode, monkeypatch):
+    monkeypatch.setattr(PeUcrlAgt, 'shield_mode', shield_mode)
+    prior_knowledge = PriorKnowledge()
+    agt = PeUcrlAgt(seed=0, prior_knowledge=prior_knowledge, regulatory_constraints={'prism_props': 'P>=0.5 [ X X n<=1 ]'})
+    agt.reset_seed()
+    state = train_steps(agt, prior_knowledge, 50)
+    assert agt.bounded_property is not None
+    # utils.train backs up the agent with pickle
+    copy = pkl.loads(pkl.dumps(agt))
+    assert copy.bounded_property.operators == agt.bounded_property.operators
+    assert (copy.policy == agt.policy).all()
+    copy.sample_action(state)
@@ -0,0 +1,48 @@
+import queue
+import threading
+
+
+class BackgroundWriter:
+
+    """Runs file writes on a background thread so that the training loop does not wait on the disk.
+    Writes are queued in order, and a full queue blocks the training loop until the thread catches up.
+    An error in the thread is raised in the training loop on the next submit or on close, later writes are dropped.
+    close waits until every queued write is done.
+    """
+
+    def __init__(self, max_size=16):
+        """max_size: number of writes that can be queued before submit blocks"""
+        self.queue = queue.Queue(maxsize=max_size)
+        self.error = None
+        self.thread = threading.Thread(target=self.work, name='background_writer', daemon=True)
+        self.thread.start()
+
+    def work(self):
+        while True:
+            task = self.queue.get()
+            if task is None:
+                return
+            if self.error is not None:
+                continue # keep emptying the queue so that submit never blocks for good
+            function, args = task
+            try:
+                function(*args)
+            except BaseException as error:
+                self.error = error
+
+    def check(self):
+        if self.error is not None:
+            raise RuntimeError('Writing in the background failed: ' + str(self.error)) from self.error
+
+    def submit(self, function, *args):
+        """Queues function(*args), the arguments must not be modified afterwards."""
+        self.check()
+        if not self.thread.is_alive():
+            raise RuntimeError('The background writer is closed.')
+        self.queue.put((function, args))
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.check()
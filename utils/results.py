@@ -0,0 +1,196 @@
+import copy as cp
+import json
+import numpy as np
+import os
+
+
+# The columns of data.csv before the run-level constants, as (name in data.csv, source, key in the data of the source, kind).
+# Missing values are stored as -1 for 'int' and as nan for 'float', and are written as empty fields in data.csv.
+columns = [
+    ('time step', 'env', 'time_step', 'int'),
+    ('reward', 'env', 'reward', 'float'),
+    ('side effects incidence', 'env', 'side_effects_incidence', 'float'),
+    ('off policy time', 'agt', 'off_policy_time', 'float'),
+    ('updated cells', 'agt', 'updated_cells', 'str'),
+    ('update kinds', 'agt', 'update_kinds', 'str'),
+    ('prism error', 'agt', 'prism_error', 'str'),
+    ('verification cache hits', 'agt', 'verification_cache_hits', 'int'),
+    ('verification cache misses', 'agt', 'verification_cache_misses', 'int'),
+    ('mean penalty', 'agt', 'mean_penalty', 'float'),
+    ('max penalty', 'agt', 'max_penalty', 'float'),
+]
+dtypes = {'int': np.int64, 'float': np.float64}
+missing_values = {'int': -1, 'float': np.nan}
+
+
+class ResultsWriter:
+
+    """Writes the per-step data of a run to NPZ shards of chunk_size rows in path/data/.
+    Rows are buffered in typed arrays, shard i holds the rows from i * chunk_size on.
+    The agent name, the regulatory constraints and the keyword arguments of train are constant over a run
+    and are stored once in path/data/metadata.json, together with the number of written rows.
+    flush writes the buffer before it is full, as the last shard, which is rewritten by later flushes until it is full.
+    A continued run reads the last shard back into the buffer.
+    Every flush appends the new rows to data.csv in its usual layout.
+    Given a BackgroundWriter, all file writes go through it, in order.
+    """
+
+    def __init__(self, path, chunk_size=10000, csv_export=True, writer=None, **kwargs):
+        """
+        path: directory of the run
+        chunk_size: number of rows per shard, a continued run keeps the chunk_size it started with
+        csv_export: whether flush appends the rows to data.csv, export_csv does it later otherwise
+        writer: BackgroundWriter for the file writes, None writes in the calling thread
+        kwargs: the extra columns of data.csv, see initialize_data
+        """
+        self.path = path
+        self.writer = writer
+        self.csv_export = csv_export
+        os.makedirs(path + 'data/', exist_ok=True)
+        self.metadata = load_metadata(path)
+        if self.metadata is None:
+            self.metadata = {
+                'columns': [name for name, _, _, _ in columns],
+                'constants': {},
+                'extra_columns': {key: str(value) for key, value in kwargs.items()},
+                'chunk_size': chunk_size,
+                'n_rows': 0,
+                'n_exported_rows': 0,
+            }
+        self.chunk_size = self.metadata['chunk_size']
+        self.buffers = {
+            name: np.full(self.chunk_size, missing_values[kind], dtype=dtypes[kind]) if kind != 'str' else [''] * self.chunk_size
+            for name, _, _, kind in columns
+        }
+        # the buffer holds the rows of the last shard, which starts at first_row
+        self.first_row = self.metadata['n_rows'] - self.metadata['n_rows'] % self.chunk_size
+        self.n_buffered = self.metadata['n_rows'] - self.first_row
+        if self.n_buffered >= 1:
+            with np.load(shard_path(path, self.first_row // self.chunk_size)) as shard:
+                for name, _, _, kind in columns:
+                    self.buffers[name][:self.n_buffered] = shard[name][:self.n_buffered].tolist() if kind == 'str' else shard[name][:self.n_buffered]
+
+    def append(self, env, agt):
+        """env, agt: the data of the environment and the agent as returned by their get_data"""
+        if 'agent' not in self.metadata['constants']:
+            self.metadata['constants']['agent'] = str(agt['name'])
+            self.metadata['constants']['regulatory constraints'] = str(agt['regulatory_constraints']).replace(',',' &').replace(': ', '=')[1:-1]
+        row = self.n_buffered
+        for name, source, key, kind in columns:
+            value = (env if source == 'env' else agt).get(key, '') # not reported by all agents
+            if kind == 'str':
+                self.buffers[name][row] = str(value)
+            else:
+                self.buffers[name][row] = missing_values[kind] if value == '' or value is None else value
+        self.n_buffered += 1
+        if self.n_buffered == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Writes the rows that were appended since the last flush, and starts a new shard if the buffer is full."""
+        if self.first_row + self.n_buffered > self.metadata['n_rows']:
+            arrays = {
+                name: np.array(self.buffers[name][:self.n_buffered]) if kind == 'str' else self.buffers[name][:self.n_buffered].copy()
+                for name, _, _, kind in columns
+            }
+            self.run(write_shard, shard_path(self.path, self.first_row // self.chunk_size), arrays)
+            self.metadata['n_rows'] = self.first_row + self.n_buffered
+            # a copy, since the metadata keeps changing while a background write is pending
+            if self.csv_export:
+                self.run(export_csv, self.path, cp.deepcopy(self.metadata))
+                self.metadata['n_exported_rows'] = self.metadata['n_rows']
+            else:
+                self.run(write_metadata, self.path, cp.deepcopy(self.metadata))
+        if self.n_buffered == self.chunk_size:
+            self.first_row += self.chunk_size
+            self.n_buffered = 0
+            for name, _, _, kind in columns:
+                if kind != 'str':
+                    self.buffers[name][:] = missing_values[kind]
+
+    def close(self):
+        self.flush()
+
+    def run(self, function, *args):
+        if self.writer is None:
+            function(*args)
+        else:
+            self.writer.submit(function, *args)
+
+
+def shard_path(path, index):
+    return path + 'data/shard_' + str(index).zfill(6) + '.npz'
+
+
+def load_metadata(path):
+    if not os.path.isfile(path + 'data/metadata.json'):
+        return None
+    with open(path + 'data/metadata.json') as metadata_file:
+        return json.load(metadata_file)
+
+
+def write_metadata(path, metadata):
+    # written to a temporary file first so that an interrupted run never leaves corrupt metadata
+    with open(path + 'data/metadata.json.tmp', 'w') as metadata_file:
+        json.dump(metadata, metadata_file)
+    os.replace(path + 'data/metadata.json.tmp', path + 'data/metadata.json')
+
+
+def write_shard(file_path, arrays):
+    tmp_path = file_path[:-len('.npz')] + '.tmp.npz'
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, file_path)
+
+
+def iter_shards(path, metadata, first_row=0):
+    """Yields the index of the first row and a dict from column names to arrays for each shard from first_row on."""
+    chunk_size = metadata['chunk_size']
+    for start in range(first_row - first_row % chunk_size, metadata['n_rows'], chunk_size):
+        stop = min(start + chunk_size, metadata['n_rows'])
+        with np.load(shard_path(path, start // chunk_size)) as shard:
+            yield start, {name: shard[name][:stop - start] for name, _, _, _ in columns}
+
+
+def load_results(path):
+    """Returns the metadata and a dict from column names to arrays with all rows of the run."""
+    metadata = load_metadata(path)
+    shards = [arrays for _, arrays in iter_shards(path, metadata)]
+    results = {}
+    for name, _, _, kind in columns:
+        if len(shards) >= 1:
+            results[name] = np.concatenate([arrays[name] for arrays in shards])
+        else:
+            results[name] = np.zeros(0, dtype=dtypes.get(kind, str))
+    return metadata, results
+
+
+def csv_field(value, kind):
+    if kind == 'int':
+        return '' if value == -1 else str(value)
+    elif kind == 'float':
+        return '' if value != value else str(value) # nan
+    return value
+
+
+def export_csv(path, metadata=None):
+    """
+    Appends the rows that are not yet in data.csv, in the layout of initialize_data and save_data.
+    The rows are converted one shard at a time, metadata defaults to the metadata on disk.
+    """
+    if metadata is None:
+        metadata = load_metadata(path)
+    first_row = metadata['n_exported_rows']
+    constants = [metadata['constants'].get('agent', ''), metadata['constants'].get('regulatory constraints', '')]
+    constants += list(metadata['extra_columns'].values())
+    suffix = ''.join(',' + str(constant) for constant in constants) + '\n'
+    with open(path + 'data.csv', 'a') as data_file:
+        if data_file.tell() == 0:
+            data_file.write(','.join(metadata['columns'] + ['agent', 'regulatory constraints'] + list(metadata['extra_columns'])) + '\n')
+        for start, arrays in iter_shards(path, metadata, first_row):
+            fields = [
+                [csv_field(value, kind) for value in arrays[name][max(0, first_row - start):].tolist()]
+                for name, _, _, kind in columns
+            ]
+            data_file.writelines(','.join(row) + suffix for row in zip(*fields))
+    metadata['n_exported_rows'] = metadata['n_rows']
+    write_metadata(path, metadata)
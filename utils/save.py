@@ -54,6 +54,14 @@ def initialize_data(path, **kwargs):
         data_file.write(',')
         data_file.write('prism error')
         data_file.write(',')
+        data_file.write('verification cache hits')
+        data_file.write(',')
+        data_file.write('verification cache misses')
+        data_file.write(',')
+        data_file.write('mean penalty')
+        data_file.write(',')
+        data_file.write('max penalty')
+        data_file.write(',')
         data_file.write('agent')
         data_file.write(',')
         data_file.write('regulatory constraints')
@@ -84,6 +92,14 @@ def save_data(
         data_file.write(',')
         data_file.write(str(agt['prism_error']))
         data_file.write(',')
+        data_file.write(str(agt.get('verification_cache_hits', ''))) # not reported by all agents
+        data_file.write(',')
+        data_file.write(str(agt.get('verification_cache_misses', '')))
+        data_file.write(',')
+        data_file.write(str(agt.get('mean_penalty', ''))) # only reported by AUP
+        data_file.write(',')
+        data_file.write(str(agt.get('max_penalty', '')))
+        data_file.write(',')
         data_file.write(str(agt['name']))
         data_file.write(',')
         data_file.write(str(agt['regulatory_constraints']).replace(',',' &').replace(': ', '=')[1:-1])
@@ -94,13 +110,19 @@ def save_data(
         
 
 def save_backup(path,env,agt):
+    write_backup(path, snapshot(env,agt))
+
+def snapshot(env,agt):
+    """Pickles env and agt right away, so that the bytes can be written later while training continues."""
+    return pkl.dumps(
+        {
+            'env': env,
+            'agt': agt,
+        },
+    )
+
+def write_backup(path, backup):
+    # replaced in one step so that an interrupted write never corrupts the last backup
     with open(path + 'tmp_backup.pkl', 'wb') as backup_file:
-        pkl.dump(
-            {
-                'env': env,
-                'agt': agt,
-            },
-            backup_file,
-        )
-    os.system('cp -f ' + path + 'tmp_backup.pkl ' + path + 'backup.pkl')
-    os.system('rm ' + path + 'tmp_backup.pkl')
\ No newline at end of file
+        backup_file.write(backup)
+    os.replace(path + 'tmp_backup.pkl', path + 'backup.pkl')
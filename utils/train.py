@@ -1,4 +1,6 @@
-from .save import save_data, save_backup
+from .background import BackgroundWriter
+from .results import ResultsWriter
+from .save import snapshot, write_backup
 
 import gymnasium as gym
 import os
@@ -36,26 +38,40 @@ def train(
     agt,
     max_n_time_steps: int,
     restart=False,
+    chunk_size=10000,
+    max_queue_size=16,
     **kwargs,
 ):
 
-    if restart is True:
-        state = env.get_state()
-        info = env.get_info()
-    else:
-        state, info = env.reset()
-        agt.reset_seed()
-        save_data(path,env=env.get_data(),agt=agt.get_data(),**kwargs)
-        
+    # rows are buffered and written in shards of chunk_size rows to path/data/, and appended to data.csv at every flush
+    # files are written by a background thread, only pickling the backups happens in the loop
+    writer = BackgroundWriter(max_size=max_queue_size)
+    results = ResultsWriter(path, chunk_size=chunk_size, writer=writer, **kwargs)
+    try:
+
+        if restart is True:
+            state = env.get_state()
+            info = env.get_info()
+        else:
+            state, info = env.reset()
+            agt.reset_seed()
+            results.append(env=env.get_data(),agt=agt.get_data())
+
+        for t in range(max_n_time_steps):
 
-    for t in range(max_n_time_steps):
+            action = agt.sample_action(state)
+            state, reward, terminated, truncated, info = env.step(action)
+            agt.update(state, reward, info)
+            results.append(env=env.get_data(),agt=agt.get_data())
+            if (t + 1) % 1000 == 0 or t == max_n_time_steps - 1:
+                results.flush() # rewrites the last shard, so that the data always reaches as far as the backup
+                writer.submit(write_backup, path, snapshot(env,agt))
 
-        action = agt.sample_action(state)
-        state, reward, terminated, truncated, info = env.step(action)
-        agt.update(state, reward, info)
-        save_data(path,env=env.get_data(),agt=agt.get_data(),**kwargs)
-        if (t + 1) % 1000 == 0 or t == max_n_time_steps - 1:
-            save_backup(path,env,agt)
+    finally:
+        try:
+            results.close()
+        finally:
+            writer.close() # waits for all writes and raises their errors
 
     with open(path + 'completed.txt', 'a') as completed_file:
         completed_file.write('completed after this number of time steps: ' + str(t + 1) + '\n')